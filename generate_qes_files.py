@@ -1,12 +1,13 @@
-import xsdtools
-import pathlib 
-from collections import deque 
-from glob import glob
+import os
+from xsdtools.batch import BatchJob, run_batch, format_summary
 
 #schema = '../qeschemas/PW_CPV/test_schemas/qes_211101.xsd' 
 schema_test = './tests/schemas/qe/qes-refactored.xsd' 
-temps = map(pathlib.Path,glob('src/xsdtools/codes/templates/qe/*/qes_*_module.f90.jinja'))
 
-g1 = ( (xsdtools.QEFortranGenerator(schema_test, p.parent ),p.name) for p in temps) 
-g2 = (_[0].render_to_files(_[1], force=True) for _ in g1)
-deque(g2, maxlen=0)
+# Each schema is parsed once, the jobs are rendered in parallel. More schemas
+# or generators can be added as jobs, or listed in a manifest file for the
+# command `xsdtools batch MANIFEST`.
+jobs = [
+    BatchJob(schema_test, 'QE', '*/qes_*_module.f90.jinja', force=True),
+]
+print(format_summary(run_batch(jobs, max_workers=os.cpu_count())))
@@ -7,7 +7,34 @@
 # See the file 'LICENSE' in the root directory of the present distribution,
 # or https://opensource.org/licenses/BSD-3-Clause
 #
+import os
+import sys
 from setuptools import find_packages, setup
+from setuptools.command.build_py import build_py
+
+
+class BuildPyCommand(build_py):
+    """Builds the bundles of precompiled templates of the generators."""
+
+    def run(self):
+        super(BuildPyCommand, self).run()
+        if self.dry_run:
+            return
+
+        sys.path.insert(0, os.path.abspath('src'))
+        try:
+            from xsdtools import QEFortranGenerator
+        except ImportError as err:
+            self.warn("precompiled templates not built: {}".format(err))
+            return
+        finally:
+            sys.path.pop(0)
+
+        target = os.path.join(self.build_lib, 'xsdtools', 'codes',
+                              QEFortranGenerator.compiled_templates)
+        self.mkpath(target)
+        QEFortranGenerator.compile_templates(target)
+
 
 with open("README.rst") as readme:
     long_description = readme.read()
@@ -18,6 +45,7 @@ setup(
     packages=find_packages('src'),
     package_dir={'': 'src'},
     include_package_data=True,
+    cmdclass={'build_py': BuildPyCommand},
     entry_points={
         'console_scripts': ['xsdtools=xsdtools.__main__:main']
     },
@@ -5,11 +5,37 @@
 # See the file 'LICENSE' in the root directory of the present distribution,
 # or https://opensource.org/licenses/BSD-3-Clause
 #
-from xmlschema.extras.codegen import filter_method, test_method, AbstractGenerator, PythonGenerator
+import importlib
 
-from .c_generator import CGenerator
-from .fortran_generator import FortranGenerator
-from .codes import QEFortranGenerator
+from .registry import get_generator_class, register_generator
+
+# Generators and their dependencies (xmlschema and Jinja2) are imported
+# at first access, so the command line interface starts quickly.
+_LAZY_ATTRIBUTES = {
+    'filter_method': 'xmlschema.extras.codegen',
+    'test_method': 'xmlschema.extras.codegen',
+    'AbstractGenerator': 'xsdtools.abstract_generator',
+    'CGenerator': 'xsdtools.c_generator',
+    'PythonGenerator': 'xsdtools.python_generator',
+    'FortranGenerator': 'xsdtools.fortran_generator',
+    'QEFortranGenerator': 'xsdtools.codes.qe',
+    'QEPythonGenerator': 'xsdtools.codes.qe_python',
+}
 
 __all__ = ['filter_method', 'test_method', 'AbstractGenerator', 'PythonGenerator',
-           'CGenerator', 'FortranGenerator', 'QEFortranGenerator']
+           'CGenerator', 'FortranGenerator', 'QEFortranGenerator',
+           'QEPythonGenerator', 'get_generator_class', 'register_generator']
+
+
+def __getattr__(name):
+    try:
+        module_name = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    value = globals()[name] = getattr(importlib.import_module(module_name), name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
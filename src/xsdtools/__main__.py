@@ -9,39 +9,138 @@
 #
 import sys
 import os
+import json
 import argparse
 import logging
 import pathlib
 
-from xmlschema import XMLSchema, XMLSchema11
-from xmlschema.cli import xsd_version_number, get_loglevel
-from xmlschema.exceptions import XMLSchemaValueError
+# xmlschema, Jinja2 and the generators are imported after the parsing
+# of the arguments, so the help and the argument errors are fast.
+from xsdtools.registry import GENERATORS, ENTRY_POINTS_GROUP, get_generator_class
 
-from xmlschema.extras.codegen import PythonGenerator, is_shell_wildcard
-from xsdtools import CGenerator, FortranGenerator, QEFortranGenerator
+PROGRAM_NAME = os.path.basename(sys.argv[0])
 
 
-PROGRAM_NAME = os.path.basename(sys.argv[0])
+def xsd_version_number(value):
+    if value not in ('1.0', '1.1'):
+        raise argparse.ArgumentTypeError("%r is not a valid XSD version" % value)
+    return value
+
+
+def template_option(value):
+    try:
+        name, value = value.split('=', 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError("option must be provided as NAME=VALUE")
+    return name.strip(), value.strip()
+
 
-GENERATORS_MAP = {
-    'C': CGenerator,
-    'Fortran': FortranGenerator,
-    'Python': PythonGenerator,
-    'QE': QEFortranGenerator,
-}
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog='{} batch'.format(PROGRAM_NAME), add_help=True,
+                                     description="render the jobs of a batch manifest, "
+                                                 "loading each schema once.")
+    parser.add_argument('-v', dest='verbosity', action='count', default=0,
+                        help="increase output verbosity.")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="number of worker processes for rendering jobs, "
+                             "1 by default (serial rendering).")
+    parser.add_argument('--json', action='store_true', default=False,
+                        help="print the summary as JSON.")
+    parser.add_argument('manifest', metavar='MANIFEST', type=str,
+                        help="a JSON file with the list of jobs.")
+    args = parser.parse_args(argv)
 
+    from xmlschema.cli import get_loglevel
+    from xsdtools.batch import load_batch, run_batch, format_summary
 
-def get_generator_class(name):
+    logging.getLogger('xsdtools').setLevel(get_loglevel(args.verbosity))
     try:
-        return GENERATORS_MAP[name]
-    except KeyError:
-        raise ValueError("--generator name must be in {!r}".format_map(list(GENERATORS_MAP)))
+        jobs = load_batch(args.manifest)
+    except (OSError, ValueError, TypeError) as err:
+        parser.error(str(err))
+
+    results = run_batch(jobs, args.jobs)
+    if args.json:
+        print(json.dumps([x.as_dict() for x in results], indent=2))
+    else:
+        print(format_summary(results))
+    sys.exit(any(x.error is not None for x in results))
+
+
+def extract_main(argv):
+    parser = argparse.ArgumentParser(prog='{} extract'.format(PROGRAM_NAME), add_help=True,
+                                     description="extract the elements of an XML file that "
+                                                 "match the paths, streaming the file and "
+                                                 "decoding the elements with their XSD types.")
+    parser.add_argument('-v', dest='verbosity', action='count', default=0,
+                        help="increase output verbosity.")
+    parser.add_argument('--schema', type=str, metavar='PATH', required=True,
+                        help="path or URL to an XSD schema.")
+    parser.add_argument('--version', type=xsd_version_number, default='1.0',
+                        help="XSD schema validator to use (default is 1.0).")
+    parser.add_argument('-L', dest='locations', nargs=2, type=str, action='append',
+                        metavar="URI/URL", help="schema location hint overrides.")
+    parser.add_argument('--npz', type=str, default=None, metavar='FILE',
+                        help="save the values of each path in a NumPy .npz file, stacking "
+                             "the arrays, instead of printing a JSON line for each element.")
+    parser.add_argument('source', metavar='XML_FILE', type=str,
+                        help="the XML file to extract from.")
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='+',
+                        help="element paths from the root, with local names separated "
+                             "by slashes (eg. espresso/step/forces), '*' matches any name.")
+    args = parser.parse_args(argv)
+
+    from xmlschema import XMLSchema, XMLSchema11
+    from xmlschema.cli import get_loglevel
+    from xsdtools.extract import SchemaExtractor
+
+    loglevel = get_loglevel(args.verbosity)
+    logging.getLogger('xsdtools').setLevel(loglevel)
+    schema_class = XMLSchema if args.version == '1.0' else XMLSchema11
+    schema = schema_class(args.schema, locations=args.locations, loglevel=loglevel)
+    try:
+        extractor = SchemaExtractor(schema, args.paths)
+    except (ImportError, ValueError) as err:
+        parser.error(str(err))
+
+    if args.npz is None:
+        for path, value in extractor.iter_extract(args.source):
+            print(json.dumps({'path': path, 'value': value},
+                             default=lambda x: x.tolist() if hasattr(x, 'tolist') else str(x)))
+        return
+
+    import numpy as np
+
+    series = {}
+    for path, value in extractor.iter_extract(args.source):
+        series.setdefault(path, []).append(value)
+
+    arrays = {}
+    for path, values in series.items():
+        try:
+            if isinstance(values[0], np.ndarray):
+                arrays[path] = np.stack(values)
+            else:
+                arrays[path] = np.array(values)
+        except ValueError as err:
+            parser.error("values of {!r} can't be stacked: {}".format(path, err))
+        if arrays[path].dtype == object:
+            parser.error("values of {!r} are not arrays or numbers, "
+                         "extract them without --npz".format(path))
+    np.savez(args.npz, **arrays)
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        return batch_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'extract':
+        return extract_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser(prog=PROGRAM_NAME, add_help=True,
                                      description="generate code for an XSD schema.")
     parser.usage = "%(prog)s [OPTION]... [FILE]...\n" \
+                   "       %(prog)s batch [OPTION]... MANIFEST\n" \
+                   "       %(prog)s extract [OPTION]... XML_FILE PATH...\n" \
                    "Try '%(prog)s --help' for more information."
 
     parser.add_argument('-v', dest='verbosity', action='count', default=0,
@@ -54,27 +153,64 @@ def main():
                         metavar="URI/URL", help="schema location hint overrides.")
     parser.add_argument('--generator', type=str, metavar='NAME', required=True,
                         help="the generator to use. Option value can be one of "
-                             "{!r}.".format(tuple(GENERATORS_MAP)))
+                             "{!r} or the name of an entry point of group {!r}."
+                             .format(tuple(GENERATORS), ENTRY_POINTS_GROUP))
     parser.add_argument('-o', '--output', type=str, default='.', metavar='DIRECTORY',
                         help="where to write the rendered files, current dir by default.")
     parser.add_argument('-f', '--force', action="store_true", default=False,
                         help="do not prompt before overwriting.")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="number of worker processes for rendering templates, "
+                             "1 by default (serial rendering).")
+    parser.add_argument('-i', '--incremental', action="store_true", default=False,
+                        help="keep a manifest of rendered files in the output directory "
+                             "and skip templates whose inputs did not change.")
+    parser.add_argument('--bytecode-cache', action="store_true", default=False,
+                        help="cache compiled templates on disk, in the default cache "
+                             "directory or in the directory provided with --cache-dir.")
+    parser.add_argument('--cache-dir', type=str, default=None, metavar='DIRECTORY',
+                        help="the directory for the bytecode cache, implies --bytecode-cache.")
+    parser.add_argument('--precompiled', action="store_true", default=False,
+                        help="use the bundle of precompiled templates of the generator, "
+                             "if available.")
+    parser.add_argument('--option', dest='options', type=template_option, action='append',
+                        default=[], metavar='NAME=VALUE',
+                        help="set a template option of the generator (eg. read_mode=children "
+                             "for QE generator), can be repeated.")
+    parser.add_argument('--profile', dest='profile', action='store_const', const='table',
+                        default=None, help="profile filters, tests and templates and "
+                                           "print a table with statistics to stderr.")
+    parser.add_argument('--profile-json', dest='profile', action='store_const', const='json',
+                        help="like --profile but print the statistics as JSON.")
+    parser.add_argument('--watch', action="store_true", default=False,
+                        help="keep running and render again, incrementally, on changes of "
+                             "the schema files or of the templates. Stop with Ctrl-C.")
+    parser.add_argument('--watch-interval', type=float, default=1.0, metavar='SECONDS',
+                        help="the polling interval of --watch, 1 second by default.")
     parser.add_argument('files', metavar='[TEMPLATE_FILE ...]',
                         nargs='*', help="Jinja template files to be rendered.")
 
     args = parser.parse_args()
 
+    from xmlschema import XMLSchema, XMLSchema11
+    from xmlschema.cli import get_loglevel
+    from xmlschema.exceptions import XMLSchemaValueError
+    from xmlschema.extras.codegen import is_shell_wildcard
+    from xsdtools.profiling import GeneratorProfiler
+
     loglevel = get_loglevel(args.verbosity)
     logger = logging.getLogger('xsdtools')
     logger.setLevel(loglevel)
 
     schema_class = XMLSchema if args.version == '1.0' else XMLSchema11
-    if args.schema is not None:
-        schema = schema_class(args.schema, locations=args.locations, loglevel=loglevel)
-    else:
-        schema = None
 
-    generator_class = get_generator_class(args.generator)
+    def load_schema():
+        return schema_class(args.schema, locations=args.locations, loglevel=loglevel)
+
+    try:
+        generator_class = get_generator_class(args.generator)
+    except ValueError as err:
+        parser.error(str(err))
     base_path = pathlib.Path(args.output)
     if not base_path.exists():
         base_path.mkdir()
@@ -95,15 +231,75 @@ def main():
         else:
             template_files[None].append(str(path))
 
-    rendered_templates = []
-    for searchpath, names in template_files.items():
-        generator = generator_class(schema, searchpath)
-        rendered_templates.extend(generator.render_to_files(
-            names, output_dir=args.output, force=args.force
-        ))
+    # Generators that are not derived from xsdtools.AbstractGenerator, eg.
+    # third-party generators based on xmlschema, get only the basic arguments.
+    generator_kwargs = {}
+    if args.bytecode_cache or args.cache_dir:
+        generator_kwargs['bytecode_cache'] = args.cache_dir or True
+    if args.precompiled:
+        generator_kwargs['precompiled'] = True
+    if args.options:
+        generator_kwargs['options'] = dict(args.options)
 
-    print("Rendered n.{} files ...".format(len(rendered_templates)))
-    sys.exit(not rendered_templates)
+    render_kwargs = {}
+    if args.jobs > 1:
+        render_kwargs['jobs'] = args.jobs
+    if args.incremental or args.watch:
+        render_kwargs['incremental'] = True
+
+    if generator_kwargs or render_kwargs or args.profile is not None:
+        from xsdtools.abstract_generator import AbstractGenerator
+
+        if not issubclass(generator_class, AbstractGenerator):
+            parser.error("generator {!r} is not derived from xsdtools.AbstractGenerator, "
+                         "it doesn't support options --bytecode-cache, --cache-dir, "
+                         "--precompiled, --option, --jobs, --incremental, --watch "
+                         "and --profile".format(args.generator))
+
+    if args.profile is not None:
+        profiler = GeneratorProfiler()
+        if render_kwargs.pop('jobs', 1) > 1:
+            logger.warning("profiling is not available with parallel rendering, "
+                           "templates are rendered serially")
+    else:
+        profiler = None
+
+    def build_generators(schema):
+        generators = []
+        for searchpath in template_files:
+            generator = generator_class(schema, searchpath, **generator_kwargs)
+            if profiler is not None:
+                generator.enable_profiling(profiler)
+            generators.append(generator)
+        return generators
+
+    def render(generators):
+        rendered = []
+        for generator, names in zip(generators, template_files.values()):
+            rendered.extend(generator.render_to_files(
+                names, output_dir=args.output, force=args.force, **render_kwargs
+            ))
+        print("Rendered n.{} files ...".format(len(rendered)))
+        return rendered
+
+    if args.watch:
+        from xsdtools.watch import watch
+
+        try:
+            watch(load_schema, build_generators, render,
+                  interval=args.watch_interval, exclude=[args.output])
+        except KeyboardInterrupt:
+            rendered_templates = None
+    else:
+        rendered_templates = render(build_generators(load_schema()))
+
+    if profiler is not None:
+        if args.profile == 'json':
+            sys.stderr.write(profiler.as_json() + '\n')
+        else:
+            sys.stderr.write(profiler.as_table() + '\n')
+    failed = rendered_templates is not None and not rendered_templates
+    sys.exit(failed and not args.incremental)
 
 
 if __name__ == '__main__':
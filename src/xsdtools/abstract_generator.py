@@ -0,0 +1,851 @@
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+import os
+import sys
+import json
+import uuid
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import jinja2
+import xmlschema
+from jinja2 import BytecodeCache, ChoiceLoader, Environment, FileSystemBytecodeCache, \
+    FileSystemLoader, ModuleLoader, TemplateNotFound, TemplateAssertionError, meta, nodes
+from xml.etree import ElementTree
+from xmlschema.names import XSD_NAMESPACE, XSD_DECIMAL, XSD_DOUBLE, XSD_FLOAT
+from xmlschema.validators import XsdType, XsdAttribute, XsdElement
+from xmlschema.extras import codegen
+from xmlschema.extras.codegen import filter_method, is_shell_wildcard
+
+from .manifest import FragmentCache, RenderManifest, hash_text, hash_file
+from .profiling import GeneratorProfiler, ProfiledTemplate
+
+try:
+    from jinja2 import pass_context
+except ImportError:  # Jinja2 < 3.0
+    from jinja2 import contextfunction as pass_context
+
+logger = logging.getLogger('xsdtools')
+
+BUNDLE_INFO_FILENAME = 'bundle.json'
+
+
+def get_cache_dir():
+    """
+    Returns the default directory for the bytecode cache of templates. The
+    directory can be set with XSDTOOLS_CACHE_DIR environment variable.
+    """
+    cache_dir = os.environ.get('XSDTOOLS_CACHE_DIR')
+    if cache_dir:
+        return cache_dir
+
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join('~', '.cache')
+    return os.path.join(os.path.expanduser(cache_home), 'xsdtools')
+
+
+class PrecompiledLoader(ModuleLoader):
+    """A loader for a bundle of precompiled templates that can list its templates."""
+
+    def __init__(self, path, names):
+        super(PrecompiledLoader, self).__init__(path)
+        self.names = names
+
+    def list_templates(self):
+        return sorted(self.names)
+
+
+def _rebuild_generator(cls, schema, searchpath, types_map, kwargs):
+    generator = cls(schema, searchpath, **kwargs)
+    generator.types_map = types_map
+    return generator
+
+
+_worker_generator = None
+_worker_options = None
+
+
+def _init_worker(generator, parent, global_vars, fragment_cache=None):
+    global _worker_generator
+    global _worker_options
+    _worker_generator = generator
+    _worker_generator.fragment_cache = fragment_cache
+    _worker_options = parent, global_vars
+
+
+def _render_worker(name, output_file):
+    parent, global_vars = _worker_options
+    template = _worker_generator.get_template(name, parent, global_vars)
+    fragment_cache = _worker_generator.fragment_cache
+    if fragment_cache is None:
+        return _worker_generator.stream_to_file(template, output_file) + (None, 0, 0)
+
+    # Fragments rendered by the worker and the cache counters of the
+    # template are sent back, for saving and reporting them.
+    fragment_cache.hits = fragment_cache.misses = 0
+    tmp_file, content_hash = _worker_generator.stream_to_file(template, output_file)
+    return tmp_file, content_hash, fragment_cache.rendered.pop(name, None), \
+        fragment_cache.hits, fragment_cache.misses
+
+
+class AbstractGenerator(codegen.AbstractGenerator):
+    """
+    Base class for xsdtools code generators. Extends the generator of
+    xmlschema with parallel and incremental rendering of templates.
+
+    :param schema: the source or the instance of the XSD schema.
+    :param searchpath: additional search path for custom templates. \
+    If provided the search path has priority over searchpaths defined \
+    in generator class.
+    :param types_map: a dictionary with custom mapping for XSD types.
+    :param bytecode_cache: an optional on-disk cache for compiled templates. \
+    Can be a directory path, a Jinja2 `BytecodeCache` instance or `True` for \
+    using the default cache directory. Cached bytecode is invalidated when \
+    the template source, the Jinja2 version or the Python version change.
+    :param precompiled: if `True` loads the class templates from the bundle \
+    of precompiled templates, if it exists and it's up to date.
+    :param options: a dictionary with options for the templates, that \
+    overrides the class default options. The options are available to \
+    templates with the global variable *options*.
+    """
+    compiled_templates: Optional[str] = None
+    """
+    Directory path of the bundle of precompiled class templates, relative
+    to the directory of the module where the class is defined.
+    """
+
+    default_options: Dict[str, Any] = {}
+    """Default values of template options. Only these options can be set."""
+
+    def __init__(self, schema, searchpath=None, types_map=None,
+                 bytecode_cache=None, precompiled=False, options=None):
+        self._sorted_types = {}
+        self._type_fingerprints = {}
+        self._fragment_hashes = {}
+        super(AbstractGenerator, self).__init__(schema, searchpath, types_map)
+        self.searchpath = searchpath
+        self.profiler = None
+        self.fragment_cache = None
+        self.bytecode_cache = bytecode_cache
+        self.precompiled = precompiled
+
+        self.options = self.default_options.copy()
+        if options:
+            for name, value in options.items():
+                if name not in self.options:
+                    raise ValueError("unknown option {!r} for {}".format(
+                        name, self.__class__.__name__
+                    ))
+                self.options[name] = value
+        self._env.globals['options'] = self.options
+        self._env.globals['fragment'] = self.render_fragment
+
+        if isinstance(bytecode_cache, BytecodeCache):
+            self._env.bytecode_cache = bytecode_cache
+        elif bytecode_cache:
+            if bytecode_cache is True:
+                directory = get_cache_dir()
+            else:
+                directory = str(bytecode_cache)
+            os.makedirs(directory, exist_ok=True)
+            self._env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+        if precompiled:
+            module_loader = self.get_precompiled_loader()
+            if module_loader is not None:
+                if isinstance(self._env.loader, ChoiceLoader):
+                    loaders = list(self._env.loader.loaders)
+                else:
+                    loaders = [self._env.loader]
+
+                # Custom templates of the searchpath keep the priority
+                loaders.insert(1 if searchpath else 0, module_loader)
+                self._env.loader = ChoiceLoader(loaders)
+
+    def set_schema(self, schema):
+        """
+        Replaces the schema of the generator, keeping its template environment,
+        so the templates already compiled are reused. The new schema must have
+        the same target namespace, the namespace of the types map is not changed.
+
+        :param schema: an XSD schema instance.
+        """
+        if schema.target_namespace != self.schema.target_namespace:
+            raise ValueError("the new schema has a different target namespace")
+        self.schema = schema
+        self._sorted_types.clear()
+        self._type_fingerprints.clear()
+
+    def __reduce__(self):
+        # Jinja environment and bound filters are not picklable:
+        # rebuild the generator from the schema and the settings.
+        kwargs = {'bytecode_cache': self.bytecode_cache,
+                  'precompiled': self.precompiled,
+                  'options': self.options}
+        return _rebuild_generator, (self.__class__, self.schema,
+                                    self.searchpath, self.types_map, kwargs)
+
+    def enable_profiling(self, profiler=None):
+        """
+        Enables the profiling of the filters, the tests and the templates
+        used by the generator. Profiling is not extended to worker processes
+        of parallel rendering.
+
+        :param profiler: an optional profiler instance, for sharing \
+        the statistics between more generators.
+        :return: the profiler instance.
+        """
+        if profiler is None:
+            profiler = GeneratorProfiler()
+        self.profiler = profiler
+
+        self._env.filters.update(
+            (k, profiler.wrap_function('filter', k, v)) for k, v in self.filters.items()
+        )
+        self._env.tests.update(
+            (k, profiler.wrap_function('test', k, v)) for k, v in self.tests.items()
+        )
+        self._env.template_class = ProfiledTemplate
+        self._env.xsdtools_profiler = profiler
+        if self._env.cache is not None:
+            self._env.cache.clear()  # templates have to be reloaded
+        return profiler
+
+    @classmethod
+    def get_class_loader(cls):
+        """Returns a loader for the templates of the class searchpaths."""
+        if not cls.searchpaths:
+            raise ValueError("no search paths defined!")
+        file_loaders = [FileSystemLoader(str(path)) for path in reversed(cls.searchpaths)]
+        return ChoiceLoader(file_loaders) if len(file_loaders) > 1 else file_loaders[0]
+
+    @classmethod
+    def get_compiled_templates_path(cls):
+        """Returns the path of the bundle of precompiled templates, if any."""
+        if cls.compiled_templates is None:
+            return None
+        elif Path(cls.compiled_templates).is_absolute():
+            return Path(cls.compiled_templates)
+
+        module_path = getattr(sys.modules.get(cls.__module__), '__file__', os.getcwd())
+        return Path(module_path).parent.joinpath(cls.compiled_templates)
+
+    @classmethod
+    def get_templates_hash(cls):
+        """Returns a hash of the sources of all the class templates."""
+        env = Environment(loader=cls.get_class_loader())
+        sources = []
+        for name in env.list_templates():
+            sources.extend((name, env.loader.get_source(env, name)[0]))
+        return hash_text(*sources)
+
+    @classmethod
+    def compile_templates(cls, target=None):
+        """
+        Compiles the class templates to Python modules, writing a bundle
+        that can be loaded with the *precompiled* option. The bundle is
+        meant to be built before packaging, so that it's shipped with
+        the distribution.
+
+        :param target: the target directory, for default is the path \
+        defined by the class attribute *compiled_templates*.
+        :return: the path of the bundle directory.
+        """
+        if target is None:
+            target = cls.get_compiled_templates_path()
+            if target is None:
+                raise ValueError("no compiled_templates path defined!")
+
+        target = Path(target)
+        if target.is_dir():
+            for path in target.glob('tmpl_*.py'):
+                path.unlink()
+
+        # Filters and tests are looked up by name at rendering time, so
+        # for compiling the templates only their names are required.
+        env = Environment(loader=cls.get_class_loader())
+        for name in dir(cls):
+            func = getattr(cls, name, None)
+            func = getattr(func, '__func__', func)
+            if getattr(func, 'is_filter', False):
+                env.filters[name] = func
+            elif getattr(func, 'is_test', False):
+                env.tests[name] = func
+        type_mapping_filter = '{}_type'.format(cls.formal_language).lower().replace(' ', '_')
+        env.filters.setdefault(type_mapping_filter, cls.map_type)
+
+        env.compile_templates(str(target), zip=None, log_function=logger.info)
+
+        bundle_info = {
+            'jinja2': jinja2.__version__,
+            'templates': cls.get_templates_hash(),
+            'names': env.list_templates(),
+        }
+        with target.joinpath(BUNDLE_INFO_FILENAME).open('w') as fp:
+            json.dump(bundle_info, fp, indent=2)
+            fp.write('\n')
+        return str(target)
+
+    @classmethod
+    def get_precompiled_loader(cls):
+        """
+        Returns a loader for the bundle of precompiled templates. Returns `None`
+        if the bundle doesn't exist or if it doesn't match the Jinja2 version
+        or the sources of the class templates.
+        """
+        path = cls.get_compiled_templates_path()
+        if path is None:
+            return None
+
+        try:
+            with path.joinpath(BUNDLE_INFO_FILENAME).open() as fp:
+                bundle_info = json.load(fp)
+        except (OSError, ValueError) as err:
+            logger.debug("no precompiled templates for %r: %s", cls.__name__, str(err))
+            return None
+
+        if bundle_info.get('jinja2') != jinja2.__version__:
+            logger.warning("precompiled templates %r are built with a different "
+                           "version of Jinja2, ignored", str(path))
+            return None
+        elif bundle_info.get('templates') != cls.get_templates_hash():
+            logger.warning("precompiled templates %r are outdated, ignored", str(path))
+            return None
+
+        return PrecompiledLoader(str(path), bundle_info.get('names', []))
+
+    @filter_method
+    def sort_types(self, xsd_types, accept_circularity=False):
+        """
+        Returns a sorted sequence of XSD types usable for building type declarations.
+        Simple types and complex types with simple content come first, then complex
+        types are sorted by dependency level, keeping the input order within a level.
+        The sort is linear in the number of types and of their child elements and
+        its result is memoised, so templates that share the generator sort once.
+
+        :param xsd_types: a sequence with XSD types.
+        :param accept_circularity: if set to `True` circularities \
+        are accepted and appended at the end. Defaults to `False`.
+        :return: a list with ordered types.
+        """
+        if not isinstance(xsd_types, (list, tuple)):
+            try:
+                xsd_types = list(xsd_types.values())
+            except AttributeError:
+                pass
+
+        key = tuple(xsd_types), accept_circularity
+        try:
+            return list(self._sorted_types[key])
+        except KeyError:
+            pass
+
+        assert all(isinstance(x, XsdType) for x in xsd_types)
+        ordered_types = [x for x in xsd_types if x.is_simple()]
+        ordered_types.extend(x for x in xsd_types if x.is_complex() and x.has_simple_content())
+        unordered = [x for x in xsd_types if x.is_complex() and not x.has_simple_content()]
+
+        # Build the dependency graph: an edge from each child type to its parents
+        dependants = {x: [] for x in unordered}
+        in_degree = dict.fromkeys(unordered, 0)
+        for xsd_type in unordered:
+            child_types = {e.type for e in xsd_type.content.iter_elements()}
+            for child_type in child_types:
+                if child_type in dependants:
+                    dependants[child_type].append(xsd_type)
+                    in_degree[xsd_type] += 1
+
+        # Kahn's algorithm, computing the dependency level of each type
+        levels = {}
+        frontier = [x for x in unordered if not in_degree[x]]
+        level = 0
+        while frontier:
+            next_frontier = []
+            for xsd_type in frontier:
+                levels[xsd_type] = level
+                for other in dependants[xsd_type]:
+                    in_degree[other] -= 1
+                    if not in_degree[other]:
+                        next_frontier.append(other)
+            frontier = next_frontier
+            level += 1
+
+        buckets = [[] for _ in range(level)]
+        for xsd_type in unordered:
+            if xsd_type in levels:
+                buckets[levels[xsd_type]].append(xsd_type)
+        for bucket in buckets:
+            ordered_types.extend(bucket)
+
+        if len(levels) < len(unordered):
+            circular = [x for x in unordered if x not in levels]
+            if not accept_circularity:
+                raise ValueError("circularity found between {!r}: {}".format(
+                    circular, ' -> '.join(x.local_name or repr(x)
+                                          for x in self._find_cycle(circular))
+                ))
+            ordered_types.extend(circular)
+
+        assert len(xsd_types) == len(ordered_types)
+        self._sorted_types[key] = ordered_types
+        return list(ordered_types)
+
+    @staticmethod
+    def _find_cycle(xsd_types):
+        """Returns a dependency cycle between the provided types, that must contain one."""
+        candidates = set(xsd_types)
+        xsd_type = xsd_types[0]
+        path = []
+        positions = {}
+        while xsd_type not in positions:
+            positions[xsd_type] = len(path)
+            path.append(xsd_type)
+            for e in xsd_type.content.iter_elements():
+                if e.type in candidates:
+                    xsd_type = e.type
+                    break
+            else:
+                break  # pragma: no cover
+        return path[positions.get(xsd_type, 0):] + [xsd_type]
+
+    @staticmethod
+    @filter_method
+    def child_elements(xsd_type):
+        """Returns the child elements of a complex content, one for each tag name."""
+        if not xsd_type.has_complex_content():
+            return []
+        elements = {}
+        for element in xsd_type.content.iter_elements():
+            elements.setdefault(element.local_name, element)
+        return list(elements.values())
+
+    def get_value_kind(self, obj):
+        """
+        Returns the kind of values of a simple type or of a simple content,
+        as a couple with one of 'bool', 'int', 'float' and 'str' and a flag
+        that is `True` for list types.
+
+        :param obj: an XSD type, an XSD attribute or an XSD element.
+        """
+        xsd_type = obj.type if isinstance(obj, (XsdAttribute, XsdElement)) else obj
+        if xsd_type.is_complex():
+            xsd_type = xsd_type.content
+
+        is_list = xsd_type.is_list()
+        if is_list:
+            while not hasattr(xsd_type, 'item_type'):
+                xsd_type = xsd_type.base_type
+            xsd_type = xsd_type.item_type
+
+        xsd_types = self.schema.meta_schema.types
+        if xsd_type.is_derived(xsd_types['boolean']):
+            return 'bool', is_list
+        elif xsd_type.is_derived(xsd_types['integer']):
+            return 'int', is_list
+        elif xsd_type.root_type.name in (XSD_DOUBLE, XSD_FLOAT, XSD_DECIMAL):
+            return 'float', is_list
+        return 'str', is_list
+
+    def iter_templates(self, names, parent=None, global_vars=None):
+        """
+        Yields the templates matching the provided names, expanding shell
+        wildcards. Not found templates are skipped with a debug message.
+
+        :param names: a template name or a list of template names.
+        :param parent: the parent template name, if any.
+        :param global_vars: optional global variables for the templates.
+        """
+        if isinstance(names, str):
+            names = [names]
+        elif not all(isinstance(x, str) for x in names):
+            raise TypeError("'names' argument must contain only strings!")
+
+        for name in names:
+            if is_shell_wildcard(name):
+                template_names = self.matching_templates(name)
+            else:
+                template_names = [name]
+
+            for template_name in template_names:
+                try:
+                    template = self._env.get_template(template_name, parent, global_vars)
+                except TemplateNotFound as err:
+                    logger.debug("name %r: %s", template_name, str(err))
+                except TemplateAssertionError as err:
+                    logger.warning("template %r: %s", template_name, str(err))
+                else:
+                    yield template
+
+    def get_schema_hash(self):
+        """
+        Returns a hash of the sources of the schema and of its imported and
+        included schemas. Meta-schemas are represented by xmlschema version.
+        """
+        meta_schema = self.schema.meta_schema
+        if meta_schema is None:
+            meta_schemas = set()
+        else:
+            meta_schemas = set(meta_schema.maps.iter_schemas())
+
+        sources = sorted(
+            (schema.url or '', schema.source.get_text())
+            for schema in self.schema.maps.iter_schemas() if schema not in meta_schemas
+        )
+        return hash_text(xmlschema.__version__, *(x for item in sources for x in item))
+
+    def get_template_source(self, name):
+        """
+        Returns the source of a template. Precompiled templates have no sources,
+        so they are read from the file-system loaders of the environment.
+        """
+        loader = self._env.loader
+        if not isinstance(loader, ChoiceLoader):
+            return loader.get_source(self._env, name)[0]
+
+        for loader in loader.loaders:
+            if isinstance(loader, ModuleLoader):
+                continue
+            try:
+                return loader.get_source(self._env, name)[0]
+            except TemplateNotFound:
+                pass
+        raise TemplateNotFound(name)
+
+    def get_template_hash(self, name):
+        """
+        Returns a hash of the source of a template and of the templates that it
+        includes, imports, extends or renders as fragments. Returns `None` if the
+        template refers to other templates dynamically, so its dependencies cannot
+        be determined.
+        """
+        sources = []
+        names = [name]
+        visited = set()
+        while names:
+            name = names.pop()
+            if name in visited:
+                continue
+            visited.add(name)
+
+            source = self.get_template_source(name)
+            sources.extend((name, source))
+            ast = self._env.parse(source)
+            for ref_name in meta.find_referenced_templates(ast):
+                if ref_name is None:
+                    return None
+                names.append(ref_name)
+
+            for node in ast.find_all(nodes.Call):
+                if isinstance(node.node, nodes.Name) and node.node.name == 'fragment':
+                    if not node.args or not isinstance(node.args[0], nodes.Const):
+                        return None
+                    names.append(node.args[0].value)
+
+        return hash_text(*sources)
+
+    def get_inputs_hash(self, name, schema_hash=None, global_vars=None):
+        """
+        Returns a hash of all the inputs of a template rendering, or `None`
+        if the dependencies of the template cannot be determined.
+
+        :param name: the template name.
+        :param schema_hash: the hash of the schema sources, if already computed.
+        :param global_vars: the additional global variables of the template.
+        """
+        template_hash = self.get_template_hash(name)
+        if template_hash is None:
+            return None
+
+        if schema_hash is None:
+            schema_hash = self.get_schema_hash()
+        global_vars = json.dumps(global_vars or {}, sort_keys=True, default=str)
+        return hash_text(*self._get_settings(), schema_hash, template_hash, global_vars)
+
+    def _get_settings(self):
+        types_map = json.dumps(sorted(self.types_map.items()))
+        options = json.dumps(self.options, sort_keys=True, default=str)
+        generator = '{}.{}'.format(self.__class__.__module__, self.__class__.__qualname__)
+        return generator, types_map, options
+
+    def get_type_fingerprint(self, xsd_type):
+        """
+        Returns a hash of the definition of an XSD type and of the definitions
+        of the types, elements and attributes that it depends on, transitively.
+        Types of the XSD namespace are represented by their name.
+
+        :param xsd_type: an XSD type of the schema.
+        """
+        try:
+            return self._type_fingerprints[xsd_type]
+        except KeyError:
+            pass
+
+        if xsd_type.target_namespace == XSD_NAMESPACE or xsd_type.elem is None:
+            return hash_text(xsd_type.name or '')
+
+        # Circular references are represented by the name of the type
+        self._type_fingerprints[xsd_type] = hash_text(xsd_type.name or '')
+
+        chunks = [xsd_type.name or '', ElementTree.tostring(xsd_type.elem, encoding='unicode')]
+        dependencies = []
+        if xsd_type.base_type is not None:
+            dependencies.append(xsd_type.base_type)
+        if getattr(xsd_type, 'item_type', None) is not None:
+            dependencies.append(xsd_type.item_type)
+        dependencies.extend(getattr(xsd_type, 'member_types', None) or ())
+
+        if xsd_type.is_complex():
+            components = list(xsd_type.attributes.values())
+            if xsd_type.has_simple_content():
+                dependencies.append(xsd_type.content)
+            else:
+                components.extend(xsd_type.content.iter_elements())
+
+            for component in components:
+                chunks.append(ElementTree.tostring(component.elem, encoding='unicode'))
+                if isinstance(component, XsdElement):
+                    chunks.append('{}-{}'.format(component.min_occurs, component.max_occurs))
+                    if component.ref is not None:
+                        chunks.append(ElementTree.tostring(component.ref.elem, encoding='unicode'))
+                if getattr(component, 'type', None) is not None:
+                    dependencies.append(component.type)
+
+        chunks.extend(self.get_type_fingerprint(x) for x in dependencies)
+        fingerprint = self._type_fingerprints[xsd_type] = hash_text(*chunks)
+        return fingerprint
+
+    def get_fragment_key(self, name, xsd_type, variables=None):
+        """
+        Returns the cache key of the fragment rendered by a template for an XSD
+        type, or `None` if the dependencies of the template cannot be determined.
+
+        :param name: the name of the fragment template.
+        :param xsd_type: the XSD type of the fragment.
+        :param variables: the context variables of the fragment. Functions, \
+        macros and the schema are not part of the key, the other values must \
+        be serializable to JSON, otherwise the fragment is not cacheable.
+        """
+        try:
+            template_hash = self._fragment_hashes[name]
+        except KeyError:
+            template_hash = self._fragment_hashes[name] = self.get_template_hash(name)
+
+        if template_hash is None:
+            return None
+
+        items = []
+        if variables:
+            for key, value in sorted(variables.items()):
+                if callable(value) or value is self.schema or key == 'options':
+                    continue  # options are already included in settings
+                try:
+                    items.append(json.dumps([key, value], sort_keys=True))
+                except (TypeError, ValueError):
+                    logger.debug("fragment %r not cacheable: variable %r is not "
+                                 "serializable", name, key)
+                    return None
+
+        return hash_text(*self._get_settings(), template_hash,
+                         self.get_type_fingerprint(xsd_type), *items)
+
+    @pass_context
+    def render_fragment(self, context, name, xsd_type):
+        """
+        Renders a fragment template for an XSD type, that is available to the
+        template as the variable *type*. It's the global function *fragment*
+        of templates. The fragment is rendered with the global and exported
+        variables of the calling context. If a fragment cache is set the fragment
+        is rendered only if it isn't cached for the same template, type, context
+        variables and generator settings.
+
+        :param context: the context of the template that renders the fragment.
+        :param name: the name of the fragment template.
+        :param xsd_type: the XSD type.
+        """
+        template = self._env.get_template(name)
+        variables = context.get_all()
+        if self.fragment_cache is None:
+            return template.render(variables, type=xsd_type)
+
+        key = self.get_fragment_key(name, xsd_type, variables)
+        if key is None:
+            return template.render(variables, type=xsd_type)
+
+        text = self.fragment_cache.get(context.name, key)
+        if text is None:
+            text = template.render(variables, type=xsd_type)
+        self.fragment_cache.add(context.name, key, text)
+        return text
+
+    def render_template(self, template):
+        """Renders a template with the schema of the generator."""
+        return template.render(schema=self.schema)
+
+    def generate(self, name, parent=None, global_vars=None):
+        """
+        Renders a template piece by piece, yielding the chunks of text
+        of the rendered result, without building it in memory.
+
+        :param name: the template name.
+        :param parent: the parent template name, if any.
+        :param global_vars: optional global variables for the template.
+        """
+        template = self._env.get_template(name, parent, global_vars)
+        return template.generate(schema=self.schema)
+
+    def stream_to_file(self, template, output_file, buffering=1 << 16):
+        """
+        Renders a template streaming the chunks of the result to a temporary
+        file in the directory of the output file. The output file is not
+        touched, use `commit_file()` for replacing it with the rendered file.
+
+        :param template: the template instance.
+        :param output_file: the path of the output file.
+        :param buffering: the buffer size of the temporary file.
+        :return: a couple with the path of the temporary file and the \
+        hash of the rendered content.
+        """
+        output_file = Path(output_file)
+        tmp_file = output_file.with_name(
+            '.{}.{}.tmp'.format(output_file.name, uuid.uuid4().hex[:12])
+        )
+        digest = hashlib.sha256()
+        try:
+            with open(tmp_file, 'x', buffering=buffering) as fp:
+                for chunk in template.generate(schema=self.schema):
+                    fp.write(chunk)
+                    digest.update(chunk.encode('utf-8'))
+        except BaseException:
+            if tmp_file.exists():
+                tmp_file.unlink()
+            raise
+        return str(tmp_file), digest.hexdigest()
+
+    @staticmethod
+    def commit_file(tmp_file, output_file, content_hash=None):
+        """
+        Atomically replaces the output file with a rendered temporary file. If a
+        content hash is provided and the output file has the same content, the
+        output file is kept untouched and the temporary file is removed.
+        """
+        if content_hash is not None:
+            try:
+                if hash_file(output_file) == content_hash:
+                    logger.info("file %r is unchanged", str(output_file))
+                    os.unlink(tmp_file)
+                    return str(output_file)
+            except OSError:
+                pass
+
+        logger.info("write file %r", str(output_file))
+        os.replace(tmp_file, output_file)
+        return str(output_file)
+
+    def render_to_files(self, names, parent=None, global_vars=None,
+                        output_dir='.', force=False, jobs=None, incremental=False):
+        """
+        Renders the templates to files in the output directory. The name of
+        each file is the name of its template without the Jinja suffix. Each
+        file is streamed to a temporary file and then atomically renamed.
+
+        :param names: a template name or a list of template names, \
+        that can contain shell wildcards.
+        :param parent: the parent template name, if any.
+        :param global_vars: optional global variables for the templates.
+        :param output_dir: the output directory, the current directory by default.
+        :param force: if `True` overwrites existing files. With incremental \
+        rendering the files tracked by the manifest are overwritten anyway.
+        :param jobs: the number of worker processes to use. For default \
+        the templates are rendered serially in the current process.
+        :param incremental: if `True` keeps a manifest of the rendered files \
+        in the output directory and skips the templates whose inputs have not \
+        changed since the last rendering. Outdated files are overwritten only \
+        if their content differs, so unchanged files keep their mtime. The \
+        fragments rendered for XSD types are cached in the output directory \
+        and are rendered again only if the type or its dependencies change.
+        :return: a list with the paths of the rendered files.
+        """
+        output_dir = Path(output_dir)
+        self._fragment_hashes.clear()
+        if incremental:
+            manifest = RenderManifest(output_dir)
+            manifest.load()
+            schema_hash = self.get_schema_hash()
+            fragment_cache = FragmentCache(output_dir)
+            fragment_cache.load()
+        else:
+            manifest = fragment_cache = None
+
+        templates = []
+        for template in self.iter_templates(names, parent, global_vars):
+            output_file = output_dir.joinpath(Path(template.name).name).with_suffix('')
+            if manifest is None:
+                if force or not output_file.exists():
+                    templates.append((template, output_file, None))
+                continue
+
+            if not force and output_file.exists() and output_file not in manifest:
+                logger.warning("file %r is not in the manifest, use force for "
+                               "overwriting it", str(output_file))
+                continue
+
+            inputs_hash = self.get_inputs_hash(template.name, schema_hash, global_vars)
+            if inputs_hash is not None and manifest.is_up_to_date(output_file, inputs_hash):
+                logger.debug("file %r is up to date", str(output_file))
+            else:
+                templates.append((template, output_file, inputs_hash))
+
+        if jobs is None or jobs <= 1 or len(templates) <= 1:
+            results = (self._stream_with_cache(x[0], x[1], fragment_cache) for x in templates)
+        else:
+            # The schema is parsed once and shipped to each worker, the map()
+            # preserves the order, so the output is the same of a serial run.
+            max_workers = min(jobs, len(templates))
+            with ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                     initargs=(self, parent, global_vars,
+                                               fragment_cache)) as executor:
+                results = list(executor.map(
+                    _render_worker, [x[0].name for x in templates], [x[1] for x in templates]
+                ))
+
+        rendered = []
+        hits = misses = 0
+        for (template, output_file, inputs_hash), result in zip(templates, results):
+            tmp_file, content_hash, fragments = result[:3]
+            hits += result[3]
+            misses += result[4]
+            if manifest is None:
+                rendered.append(self.commit_file(tmp_file, output_file))
+            else:
+                rendered.append(self.commit_file(tmp_file, output_file, content_hash))
+                if inputs_hash is not None:
+                    manifest.update(output_file, template.name, inputs_hash, content_hash)
+            if fragments is not None:
+                fragment_cache.rendered[template.name] = fragments
+
+        if manifest is not None:
+            manifest.save()
+            fragment_cache.save()
+            if hits or misses:
+                logger.info("fragments: %d cached, %d rendered", hits, misses)
+        return rendered
+
+    def _stream_with_cache(self, template, output_file, fragment_cache):
+        if fragment_cache is None:
+            return self.stream_to_file(template, output_file) + (None, 0, 0)
+
+        hits, misses = fragment_cache.hits, fragment_cache.misses
+        previous, self.fragment_cache = self.fragment_cache, fragment_cache
+        try:
+            tmp_file, content_hash = self.stream_to_file(template, output_file)
+        finally:
+            self.fragment_cache = previous
+        return tmp_file, content_hash, fragment_cache.rendered.get(template.name), \
+            fragment_cache.hits - hits, fragment_cache.misses - misses
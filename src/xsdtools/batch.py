@@ -0,0 +1,297 @@
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+"""
+Batch rendering of many schemas with many generators and template sets, driven
+by a JSON manifest file, eg.::
+
+    {
+      "jobs": [
+        {"schema": "qes.xsd", "generator": "QE",
+         "templates": ["*/qes_*_module.f90.jinja"], "output": "fortran/"},
+        {"schema": "qes.xsd", "generator": "QE-Python",
+         "templates": ["*.py.jinja"], "output": "python/"},
+        {"schema": "ph_xmlschema.xsd", "generator": "Python",
+         "templates": ["templates/ph_types.py.jinja"], "output": "ph/"}
+      ]
+    }
+
+Relative paths are resolved from the directory of the manifest file. Template
+names that aren't existing files are looked up in the generator's templates.
+"""
+import json
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from xmlschema import XMLSchema10, XMLSchema11
+
+from .registry import get_generator_class
+from .abstract_generator import AbstractGenerator
+
+logger = logging.getLogger('xsdtools')
+
+
+class BatchJob(object):
+    """
+    A rendering job of a batch.
+
+    :param schema: the path or the URL of the XSD schema.
+    :param generator: the registered name of the generator.
+    :param templates: a list of template names or shell wildcards. Names \
+    of existing template files add their directories to the search paths.
+    :param output: the output directory, created if it doesn't exist.
+    :param name: the name of the job, for default it's composed from the \
+    schema file name and the generator name.
+    :param version: the XSD version of the schema, '1.0' or '1.1'.
+    :param locations: optional schema location hints, a map from namespace \
+    URIs to URLs.
+    :param options: template options of the generator.
+    :param force: overwrite existing files.
+    :param incremental: render only the outdated files, see `render_to_files()`.
+    """
+    _keys = ('schema', 'generator', 'templates', 'output', 'name', 'version',
+             'locations', 'options', 'force', 'incremental')
+
+    def __init__(self, schema, generator, templates, output='.', name=None, version='1.0',
+                 locations=None, options=None, force=False, incremental=False):
+        if isinstance(templates, str):
+            templates = [templates]
+        if version not in ('1.0', '1.1'):
+            raise ValueError("%r is not a valid XSD version" % version)
+
+        self.schema = schema
+        self.generator = generator
+        self.templates = list(templates)
+        self.output = output
+        self.name = name or '{}:{}'.format(Path(schema).name, generator)
+        self.version = version
+        self.locations = dict(locations or ())
+        self.options = options
+        self.force = force
+        self.incremental = incremental
+
+    def __repr__(self):
+        return '%s(name=%r, schema=%r, generator=%r)' % (
+            self.__class__.__name__, self.name, self.schema, self.generator
+        )
+
+    @classmethod
+    def from_dict(cls, data, base_dir=None):
+        """
+        Builds a job from a dictionary of a manifest. Relative paths of
+        the schema, of the template files and of the output directory
+        are resolved from the base directory.
+        """
+        if not isinstance(data, dict):
+            raise ValueError("a batch job must be an object, not %r" % data)
+        unknown = [k for k in data if k not in cls._keys]
+        if unknown:
+            raise ValueError("unknown keys %r in batch job, must be in %r" % (unknown, cls._keys))
+        for key in ('schema', 'generator', 'templates'):
+            if key not in data:
+                raise ValueError("missing key %r in batch job %r" % (key, data))
+
+        data = dict(data)
+        if base_dir is not None:
+            base_dir = Path(base_dir)
+            if '://' not in data['schema']:
+                data['schema'] = str(base_dir.joinpath(data['schema']))
+            if isinstance(data['templates'], str):
+                data['templates'] = [data['templates']]
+            data['templates'] = [str(base_dir.joinpath(x)) if base_dir.joinpath(x).is_file()
+                                 else x for x in data['templates']]
+            data['output'] = str(base_dir.joinpath(data.get('output', '.')))
+        return cls(**data)
+
+    def get_template_sets(self):
+        """
+        Returns a dictionary that maps template search paths to names. Templates
+        without an existing file are looked up in the generator's search paths.
+        """
+        template_sets = {None: []}
+        for name in self.templates:
+            path = Path(name)
+            if path.is_file():
+                template_sets.setdefault(str(path.parent), []).append(path.name)
+            else:
+                template_sets[None].append(name)
+        if not template_sets[None]:
+            del template_sets[None]
+        return template_sets
+
+
+def load_batch(path):
+    """
+    Loads the jobs of a batch manifest file.
+
+    :param path: the path of a JSON file with an object that has a list \
+    of jobs as value of the key *jobs*.
+    :return: a list of `BatchJob` instances.
+    """
+    path = Path(path)
+    with path.open() as fp:
+        data = json.load(fp)
+
+    if not isinstance(data, dict) or not isinstance(data.get('jobs'), list):
+        raise ValueError("%r is not a batch manifest: a list of jobs is required" % str(path))
+    return [BatchJob.from_dict(x, path.parent) for x in data['jobs']]
+
+
+class BatchResult(object):
+    """The result of a batch job."""
+    __slots__ = ('job', 'files', 'load_time', 'render_time', 'error')
+
+    def __init__(self, job, files=(), load_time=0.0, render_time=0.0, error=None):
+        self.job = job
+        self.files = list(files)
+        self.load_time = load_time
+        self.render_time = render_time
+        self.error = error
+
+    def __repr__(self):
+        return '%s(job=%r, files=%d, error=%r)' % (
+            self.__class__.__name__, self.job.name, len(self.files), self.error
+        )
+
+    def as_dict(self):
+        return {
+            'name': self.job.name,
+            'schema': self.job.schema,
+            'generator': self.job.generator,
+            'output': self.job.output,
+            'files': len(self.files),
+            'load_time': round(self.load_time, 6),
+            'render_time': round(self.render_time, 6),
+            'error': self.error,
+        }
+
+
+_worker_jobs = None
+
+
+def _init_batch_worker(jobs):
+    global _worker_jobs
+    _worker_jobs = jobs
+
+
+def _run_batch_job(index):
+    return _render_job(*_worker_jobs[index])
+
+
+def _render_job(job, generators, max_workers=1):
+    kwargs = {'incremental': True} if job.incremental else {}
+    start = time.perf_counter()
+    rendered = []
+    try:
+        for generator, names in generators:
+            if max_workers > 1 and isinstance(generator, AbstractGenerator):
+                kwargs['jobs'] = max_workers
+            rendered.extend(generator.render_to_files(
+                names, output_dir=job.output, force=job.force, **kwargs
+            ))
+    except Exception as err:
+        return rendered, time.perf_counter() - start, '{}: {}'.format(type(err).__name__, err)
+    return rendered, time.perf_counter() - start, None
+
+
+def run_batch(jobs, max_workers=1):
+    """
+    Runs the jobs of a batch. Each schema is loaded once, also if it's used by
+    more jobs, so its imported schemas and the meta-schema are built once too.
+    Jobs are rendered in parallel by a pool of processes, that receive the
+    loaded schemas and the generators once, at their startup. A single job
+    is rendered with parallel workers for its templates.
+
+    :param jobs: a list of `BatchJob` instances.
+    :param max_workers: the maximum number of worker processes, with 1 \
+    the jobs are rendered serially in the current process.
+    :return: a list of `BatchResult` instances, in the order of the jobs.
+    """
+    schemas = {}
+    results = []
+    pending = []
+
+    for job in jobs:
+        result = BatchResult(job)
+        results.append(result)
+
+        try:
+            generator_class = get_generator_class(job.generator)
+            if (job.options or job.incremental) and \
+                    not issubclass(generator_class, AbstractGenerator):
+                raise ValueError("generator {!r} doesn't support template options and "
+                                 "incremental rendering".format(job.generator))
+        except ValueError as err:
+            result.error = '{}: {}'.format(type(err).__name__, err)
+            logger.error("job %r: %s", job.name, err)
+            continue
+
+        key = job.schema, job.version, tuple(sorted(job.locations.items()))
+        start = time.perf_counter()
+        try:
+            schema = schemas[key]
+        except KeyError:
+            schema_class = XMLSchema10 if job.version == '1.0' else XMLSchema11
+            try:
+                schema = schemas[key] = schema_class(job.schema, locations=job.locations)
+            except Exception as err:
+                schema = schemas[key] = err
+                logger.error("job %r: schema %r not loaded: %s", job.name, job.schema, err)
+            result.load_time = time.perf_counter() - start
+
+        if isinstance(schema, Exception):
+            result.error = '{}: {}'.format(type(schema).__name__, schema)
+            continue
+
+        kwargs = {'options': job.options} if job.options else {}
+        try:
+            generators = [(generator_class(schema, searchpath, **kwargs), names)
+                          for searchpath, names in job.get_template_sets().items()]
+        except (ValueError, TypeError) as err:
+            result.error = '{}: {}'.format(type(err).__name__, err)
+            logger.error("job %r: %s", job.name, err)
+            continue
+
+        Path(job.output).mkdir(parents=True, exist_ok=True)
+        pending.append((result, (job, generators)))
+
+    if max_workers <= 1 or len(pending) <= 1:
+        outcomes = (_render_job(*x[1], max_workers=max_workers) for x in pending)
+    else:
+        with ProcessPoolExecutor(min(max_workers, len(pending)),
+                                 initializer=_init_batch_worker,
+                                 initargs=([x[1] for x in pending],)) as executor:
+            outcomes = list(executor.map(_run_batch_job, range(len(pending))))
+
+    for (result, _), (rendered, render_time, error) in zip(pending, outcomes):
+        result.files = rendered
+        result.render_time = render_time
+        result.error = error
+        if error is not None:
+            logger.error("job %r failed: %s", result.job.name, error)
+
+    return results
+
+
+def format_summary(results):
+    """Returns a table with the summary of the results of a batch."""
+    lines = ['{:<40} {:>6} {:>10} {:>10}  {}'.format(
+        'job', 'files', 'load(s)', 'render(s)', 'status'
+    )]
+    for result in results:
+        lines.append('{:<40} {:>6} {:>10.4f} {:>10.4f}  {}'.format(
+            result.job.name, len(result.files), result.load_time,
+            result.render_time, result.error or 'ok'
+        ))
+    lines.append('{:<40} {:>6} {:>10.4f} {:>10.4f}  {} failed'.format(
+        'total', sum(len(x.files) for x in results),
+        sum(x.load_time for x in results), sum(x.render_time for x in results),
+        sum(x.error is not None for x in results)
+    ))
+    return '\n'.join(lines)
@@ -5,7 +5,17 @@
 # See the file 'LICENSE' in the root directory of the present distribution,
 # or https://opensource.org/licenses/BSD-3-Clause
 #
-from xmlschema.extras.codegen import AbstractGenerator
+from xmlschema.extras.codegen import filter_method
+
+from .abstract_generator import AbstractGenerator
+
+C_KEYWORDS = frozenset((
+    'auto', 'break', 'case', 'char', 'const', 'continue', 'default', 'do', 'double',
+    'else', 'enum', 'extern', 'float', 'for', 'goto', 'if', 'inline', 'int', 'long',
+    'register', 'restrict', 'return', 'short', 'signed', 'sizeof', 'static', 'struct',
+    'switch', 'typedef', 'union', 'unsigned', 'void', 'volatile', 'while', 'bool',
+    'true', 'false',
+))
 
 
 class CGenerator(AbstractGenerator):
@@ -26,3 +36,58 @@ class CGenerator(AbstractGenerator):
         'nonNegativeInteger': 'unsigned int',
         'positiveInteger': 'unsigned int',
     }
+
+    default_options = {
+        'prefix': 'xsd',
+    }
+    """
+    Template options for C sources:
+
+      * prefix: the prefix of the names of functions, enums and macros.
+    """
+
+    value_types = {
+        'bool': 'bool',
+        'int': 'long',
+        'float': 'double',
+        'str': 'char *',
+    }
+
+    @staticmethod
+    @filter_method
+    def c_name(obj):
+        name = CGenerator.name(obj)
+        return name + '_' if name in C_KEYWORDS else name
+
+    @filter_method
+    def value_type(self, obj):
+        """The C type of a value, or of the items of a list."""
+        return self.value_types[self.get_value_kind(obj)[0]]
+
+    @filter_method
+    def value_kind(self, obj, multiple=False):
+        """
+        The name of the kind of a value, that selects the conversion of the text.
+        List kinds append converted tokens to an array, so are used also for
+        values of multiple elements.
+        """
+        kind, is_list = self.get_value_kind(obj)
+        name = {'bool': 'BOOL', 'int': 'LONG', 'float': 'DOUBLE', 'str': 'STRING'}[kind]
+        if kind == 'str' and multiple and not is_list:
+            return 'STRING_ITEM'
+        return name + '_LIST' if is_list or multiple else name
+
+    @filter_method
+    def is_list_value(self, obj, multiple=False):
+        return multiple or self.get_value_kind(obj)[1]
+
+    @staticmethod
+    @filter_method
+    def expat_name(obj):
+        """
+        The name of an element or an attribute as reported by an expat parser
+        created with a '|' namespace separator.
+        """
+        if obj.name.startswith('{'):
+            return obj.name[1:].replace('}', '|')
+        return obj.name
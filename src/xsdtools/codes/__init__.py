@@ -5,7 +5,25 @@
 # See the file 'LICENSE' in the root directory of the present distribution,
 # or https://opensource.org/licenses/BSD-3-Clause
 #
-from .qe import QEFortranGenerator
+import importlib
 
+_LAZY_ATTRIBUTES = {
+    'QEFortranGenerator': 'xsdtools.codes.qe',
+    'QEPythonGenerator': 'xsdtools.codes.qe_python',
+}
 
-__all__ = ['QEFortranGenerator']
+__all__ = ['QEFortranGenerator', 'QEPythonGenerator']
+
+
+def __getattr__(name):
+    try:
+        module_name = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    value = globals()[name] = getattr(importlib.import_module(module_name), name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
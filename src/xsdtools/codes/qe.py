@@ -5,13 +5,75 @@
 # See the file 'LICENSE' in the root directory of the present distribution,
 # or https://opensource.org/licenses/BSD-3-Clause
 #
+import os
 import re
+import uuid
+import logging
+from pathlib import Path
 
+from xmlschema.validators import XsdType, XsdElement, XsdAttribute
 from xmlschema.extras.codegen import filter_method
 from ..fortran_generator import FortranGenerator
+from ..fortran_submodules import split_module, get_dependencies, format_make_dependencies
+from ..manifest import hash_content, hash_text
 
 QE_NAMESPACE = "http://www.quantum-espresso.org/ns/qes/qes-1.0"
 
+logger = logging.getLogger('xsdtools')
+
+
+class QETypeInfo(object):
+    """Classification info of an XSD type, indexed by QE generator."""
+    __slots__ = ('is_array', 'is_matrix', 'is_vector', 'fortran_type', 'init_fortran_type',
+                 'attributes', 'init_argument_line', 'multi_sequence', 'fields')
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+
+class QEField(object):
+    """
+    A component of a QE derived type, as described by the tables of the compact
+    code mode.
+
+    :param name: the name of the XML attribute or child element, or the name \
+    of the component for the content of extended types.
+    :param role: 'attribute', 'element' or 'content'.
+    :param kind: 'integer', 'real', 'character', 'logical' or 'derived'.
+    :param size: 0 for a scalar, the size of a fixed size array or -1 for \
+    an allocatable array.
+    :param min_occurs: the minimum number of occurrences.
+    :param max_occurs: the maximum number of occurrences, `None` if unbounded.
+    :param xsd_type: the XSD type of a derived component.
+    :param optional: `True` if the component has a presence flag.
+    :param extent: the 1-based index of the field that holds the extent of \
+    an allocatable array, 0 if the array is not allocatable.
+    """
+    __slots__ = ('name', 'role', 'kind', 'size', 'min_occurs', 'max_occurs',
+                 'xsd_type', 'optional', 'extent')
+
+    def __init__(self, name, role, kind, size=0, min_occurs=1, max_occurs=1,
+                 xsd_type=None, optional=False, extent=0):
+        self.name = name
+        self.role = role
+        self.kind = kind
+        self.size = size
+        self.min_occurs = min_occurs
+        self.max_occurs = max_occurs
+        self.xsd_type = xsd_type
+        self.optional = optional
+        self.extent = extent
+
+    def __repr__(self):
+        return '%s(name=%r, role=%r, kind=%r)' % (
+            self.__class__.__name__, self.name, self.role, self.kind
+        )
+
+    @property
+    def is_multiple(self):
+        return self.max_occurs != 1
+
 
 class QEFortranGenerator(FortranGenerator):
     """
@@ -19,6 +81,8 @@ class QEFortranGenerator(FortranGenerator):
     """
     searchpaths = ['templates/qe/']
 
+    compiled_templates = 'compiled/qe/'
+
     schema_types = {
         "d2vectorType": "REAL(DP), DIMENSION(2)",
         "d3vectorType": "REAL(DP), DIMENSION(3)",
@@ -34,91 +98,447 @@ class QEFortranGenerator(FortranGenerator):
         "cell_dimensionsType": "REAL(DP), DIMENSION(6)",
     }
 
-    def __init__(self, schema, searchpath=None, types_map=None):
+    default_options = {
+        'read_mode': 'tagname',
+        'bcast_mode': 'calls',
+        'bcast_chunk_size': 1 << 26,
+        'write_mode': 'calls',
+        'write_real_format': 'ES24.15E3',
+        'write_integer_format': 'I0',
+        'write_line_values': 5,
+        'code_mode': 'unrolled',
+        'module_layout': 'single',
+        'submodule_size': 10,
+        'init_mode': 'copy',
+        'types_layout': 'fixed',
+        'read_select': 'all',
+        'write_stream': 'none',
+    }
+    """
+    Template options for QE modules:
+
+      * read_mode: 'tagname' for reading child elements of each node with \
+        getElementsByTagname, or 'children' for a single pass on direct children.
+      * bcast_mode: 'calls' for broadcasting each component with a call to \
+        mp_bcast, or 'packed' for packing objects in a byte buffer and \
+        broadcasting it with few calls.
+      * bcast_chunk_size: the maximum size in bytes of a packed broadcast.
+      * write_mode: 'calls' for writing vectors and matrices a line per call, \
+        or 'bulk' for formatting each array with a single internal write.
+      * write_real_format, write_integer_format: Fortran edit descriptors \
+        of the values written in bulk mode. The width of the buffers is \
+        computed from them, so a zero width is allowed only for integers.
+      * write_line_values: the number of values per line of vectors written \
+        in bulk mode. Matrices are written a column per line.
+      * code_mode: 'unrolled' for reading, broadcasting and resetting each \
+        type with a dedicated subroutine, or 'compact' for generic routines \
+        driven by per-type descriptor tables, with a much smaller code.
+      * module_layout: 'single' for a file for each module, or 'submodules' \
+        for a module with the interfaces of its per-type subroutines and \
+        Fortran 2008 submodules with their bodies.
+      * submodule_size: the number of types of each submodule.
+      * init_mode: 'copy' for initializing vectors and matrices with copies \
+        of the arguments, or 'move' for adding *qes_init_<type>_move* variants \
+        that take the ownership of an allocatable array with MOVE_ALLOC.
+      * types_layout: 'fixed' for derived types with fixed length strings and \
+        a tag name in each object, or 'compact' for deferred length strings, \
+        integer ids for string enumerations and a shared table of tag names.
+      * read_select: 'all' for reading the whole subtree of each node, or \
+        'paths' for an optional *paths* argument of the read routines, that \
+        selects the child elements to read.
+      * write_stream: 'none' for writing only complete objects, or 'append' \
+        for adding routines that open an element, append the items of its \
+        unbounded child element one at a time and close it.
+    """
+
+    options_choices = {
+        'read_mode': ('tagname', 'children'),
+        'bcast_mode': ('calls', 'packed'),
+        'write_mode': ('calls', 'bulk'),
+        'code_mode': ('unrolled', 'compact'),
+        'module_layout': ('single', 'submodules'),
+        'init_mode': ('copy', 'move'),
+        'types_layout': ('fixed', 'compact'),
+        'read_select': ('all', 'paths'),
+        'write_stream': ('none', 'append'),
+    }
+
+    depend_file = 'qes_modules.d'
+    """The make rules of the generated files, written in submodules layout."""
+
+    _component_pattern = re.compile(
+        r'^(INTEGER|REAL\(DP\)|CHARACTER\(len=\d+\)|LOGICAL)'
+        r'(?:, DIMENSION\((\d+|:)\))?(?:, ALLOCATABLE)?$', flags=re.IGNORECASE
+    )
+    _string_pattern = re.compile(r'^CHARACTER\(len=\d+\)$', flags=re.IGNORECASE)
+    _edit_descriptor_pattern = re.compile(
+        r'^\s*(?:[+-]?\d+P\s*,?\s*)?(EN|ES|[BDEFGIOZ])(\d+)(?:\.\d+(?:E\d+)?)?\s*$',
+        flags=re.IGNORECASE
+    )
+    _integer_widths = {'B': 32, 'G': 11, 'I': 11, 'O': 11, 'Z': 8}
+    """The maximum widths of default integers written with a zero width descriptor."""
+
+    def __init__(self, schema, searchpath=None, types_map=None,
+                 bytecode_cache=None, precompiled=False, options=None):
         if types_map is None:
             types_map = self.schema_types
         else:
-            types_map = self.schema_types.copy().update(**types_map)
+            types_map = dict(self.schema_types, **types_map)
 
-        super(QEFortranGenerator, self).__init__(schema, searchpath, types_map)
+        self._types_index = {}
+        self._type_ids = {}
+        self._type_names = set()
+        self._layout_hashes = {}
+        super(QEFortranGenerator, self).__init__(
+            schema, searchpath, types_map, bytecode_cache, precompiled, options
+        )
         assert self.schema.target_namespace == QE_NAMESPACE
+        for name, choices in self.options_choices.items():
+            if self.options[name] not in choices:
+                raise ValueError("invalid {} option {!r}, must be one of {!r}".format(
+                    name, self.options[name], choices
+                ))
+        if self.options['code_mode'] == 'compact' and (
+                self.options['read_mode'] != 'tagname' or self.options['bcast_mode'] != 'calls'):
+            raise ValueError("compact code_mode is not compatible with "
+                             "read_mode={read_mode!r} and bcast_mode={bcast_mode!r}"
+                             .format(**self.options))
+        if self.options['types_layout'] == 'compact' and (
+                self.options['code_mode'] != 'unrolled' or self.options['bcast_mode'] != 'calls'):
+            raise ValueError("compact types_layout is not compatible with "
+                             "code_mode={code_mode!r} and bcast_mode={bcast_mode!r}"
+                             .format(**self.options))
+        if self.options['read_select'] == 'paths' and self.options['code_mode'] != 'unrolled':
+            raise ValueError("read_select={read_select!r} is not compatible with "
+                             "code_mode={code_mode!r}".format(**self.options))
+        for name in ('write_real_format', 'write_integer_format'):
+            if self.format_width(self.options[name], name == 'write_integer_format') is None:
+                raise ValueError("{} option {!r} is not an edit descriptor of "
+                                 "a bounded width".format(name, self.options[name]))
+        try:
+            self.options['submodule_size'] = int(self.options['submodule_size'])
+        except (TypeError, ValueError):
+            self.options['submodule_size'] = 0
+        if self.options['submodule_size'] < 1:
+            raise ValueError("submodule_size option must be a positive integer")
+        self.build_types_index()
 
-    @staticmethod
-    @filter_method
-    def bcast_function_name(xsd_type):
-        return 'qes_bcast_' + xsd_type.local_name.replace('Type', '')
+    def set_schema(self, schema):
+        super(QEFortranGenerator, self).set_schema(schema)
+        self.build_types_index()
 
-    @staticmethod
-    @filter_method
-    def init_function_name(xsd_type):
-        name = xsd_type.local_name
-        if name in ['matrixType', 'integerMatrixType']:
-            return ', '.join(
-                'qes_init_' + name.replace('Type', '_%d' % k) for k in (1, 2, 3)
+    @property
+    def types_map(self):
+        return self._types_map
+
+    @types_map.setter
+    def types_map(self, value):
+        # The index and the layout hashes include mapped types:
+        # replacing the map invalidates them
+        self._types_map = value
+        self._types_index.clear()
+        self._layout_hashes.clear()
+
+    def build_types_index(self):
+        """
+        Builds the classification index of the schema types, used by the
+        filters. In-place changes of the types map require a rebuild.
+        """
+        self._types_index.clear()
+        self._type_ids = {x: k for k, x in enumerate(self.schema.complex_types, start=1)}
+        self._type_names = {self.type_name(x) for x in self.schema.complex_types}
+        self._layout_hashes.clear()
+        for xsd_type in self.schema.types.values():
+            self.get_type_info(xsd_type)
+
+    def get_type_info(self, xsd_type):
+        """Returns the classification info of an XSD type, indexing it if necessary."""
+        try:
+            return self._types_index[xsd_type]
+        except KeyError:
+            type_info = self._types_index[xsd_type] = QETypeInfo(
+                is_array=self._is_qes_array_type(xsd_type),
+                is_matrix=self._is_derived_from(xsd_type, 'matrixType', 'integerMatrixType'),
+                is_vector=self._is_derived_from(xsd_type, 'vectorType', 'integerVectorType'),
+                fortran_type=self._layout_fortran_type(xsd_type),
+                init_fortran_type=None,
+                attributes=self._attributes_list(xsd_type),
+                init_argument_line=self._init_argument_line(xsd_type)
+                if xsd_type.local_name else None,
+                multi_sequence=self._has_multi_sequence(xsd_type),
             )
-        elif xsd_type.is_complex():
-            return 'qes_init_' + name.replace('Type', '')
-        else:
-            return None
+            type_info.init_fortran_type = self._init_fortran_type(type_info.fortran_type)
+            return type_info
 
-    @filter_method
-    def is_qes_array_type(self, xsd_type):
-        if xsd_type.local_name in ("vectorType", "integerVectorType", "integerMatrixType"):
-            return True
-        elif xsd_type.is_derived(self.schema.types['vectorType']):
-            return True
-        elif xsd_type.is_derived(self.schema.types['integerVectorType']):
-            return True
-        elif xsd_type.is_derived(self.schema.types['integerMatrixType']):
-            return True
-        else:
-            return False
+    def map_type(self, obj):
+        if isinstance(obj, (XsdAttribute, XsdElement)):
+            obj = obj.type
+        if not isinstance(obj, XsdType):
+            return super(QEFortranGenerator, self).map_type(obj)
+        return self.get_type_info(obj).fortran_type
+
+    def stream_to_file(self, template, output_file, buffering=1 << 16):
+        """
+        Renders a template to a temporary file. In submodules layout the
+        rendered module is split and its submodules are written beside the
+        output file, keeping untouched the submodules that are unchanged.
+        """
+        tmp_file, content_hash = super(QEFortranGenerator, self).stream_to_file(
+            template, output_file, buffering
+        )
+        if self.options['module_layout'] != 'submodules':
+            return tmp_file, content_hash
+
+        with open(tmp_file) as fp:
+            result = split_module(fp.read(), self._submodule_group,
+                                  self.options['submodule_size'])
+
+        submodules = []
+        if result is not None:
+            text, submodules = result
+            with open(tmp_file, 'w') as fp:
+                fp.write(text)
+            content_hash = hash_content([text])
+
+        output_file = Path(output_file)
+        for name, text in submodules:
+            submodule_file = output_file.with_name(name + output_file.suffix)
+            submodule_tmp = submodule_file.with_name(
+                '.{}.{}.tmp'.format(submodule_file.name, uuid.uuid4().hex[:12])
+            )
+            with open(submodule_tmp, 'x') as fp:
+                fp.write(text)
+            self.commit_file(submodule_tmp, submodule_file, hash_content([text]))
+
+        for path in self._submodule_files(output_file)[len(submodules):]:
+            logger.info("remove stale submodule file %r", str(path))
+            os.unlink(path)
+        return tmp_file, content_hash
+
+    def render_to_files(self, names, parent=None, global_vars=None,
+                        output_dir='.', force=False, jobs=None, incremental=False):
+        """
+        Renders the templates to files in the output directory. In submodules
+        layout the returned list includes the submodule files of the rendered
+        modules and the make rules of the files of the templates, written in
+        the file *qes_modules.d* of the output directory.
+        """
+        rendered = super(QEFortranGenerator, self).render_to_files(
+            names, parent, global_vars, output_dir, force, jobs, incremental
+        )
+        if self.options['module_layout'] != 'submodules':
+            return rendered
+
+        for path in rendered[:]:
+            rendered.extend(str(x) for x in self._submodule_files(path))
+
+        sources = []
+        output_dir = Path(output_dir)
+        for template in self.iter_templates(names, parent, global_vars):
+            output_file = output_dir.joinpath(Path(template.name).name).with_suffix('')
+            if output_file.exists():
+                sources.append(output_file)
+                sources.extend(self._submodule_files(output_file))
+        if not sources:
+            return rendered
+
+        text = format_make_dependencies(get_dependencies(sources))
+        depend_file = output_dir.joinpath(self.depend_file)
+        depend_tmp = depend_file.with_name(
+            '.{}.{}.tmp'.format(depend_file.name, uuid.uuid4().hex[:12])
+        )
+        with open(depend_tmp, 'x') as fp:
+            fp.write(text)
+        rendered.append(self.commit_file(depend_tmp, depend_file, hash_content([text])))
+        return rendered
+
+    def _submodule_group(self, name):
+        # Per-type subroutines are grouped by type, helpers stay in the module
+        parts = name.split('_')
+        if parts[0] != 'qes':
+            return None
+        for k in range(2, len(parts)):
+            suffix = '_'.join(parts[k:])
+            for type_name in (suffix, re.sub(r'_(\d+|move|open|append|close)$', '', suffix)):
+                if type_name in self._type_names:
+                    return type_name
+        return None
 
     @staticmethod
-    @filter_method
-    def is_qes_type(xsd_type):
-        return xsd_type.target_namespace == QE_NAMESPACE
+    def _submodule_files(module_file):
+        module_file = Path(module_file)
+        prefix = module_file.stem[:-7] if module_file.stem.endswith('_module') \
+            else module_file.stem
+        pattern = re.compile(r'^{}_submodule_(\d+){}$'.format(
+            re.escape(prefix), re.escape(module_file.suffix)
+        ))
+        files = []
+        for path in module_file.parent.glob('{}_submodule_*{}'.format(prefix, module_file.suffix)):
+            match = pattern.match(path.name)
+            if match is not None:
+                files.append((int(match.group(1)), path))
+        return [x[1] for x in sorted(files)]
 
-    @filter_method
-    def is_matrix_type(self, xsd_type):
-        return xsd_type.is_derived(self.schema.types['matrixType']) \
-            or xsd_type.is_derived(self.schema.types['integerMatrixType'])
+    def get_layout_hash(self, xsd_type):
+        """
+        Returns a short hash of the layout of the binary records of a type, made
+        of the names, the Fortran types and the occurrences of its components
+        and of the layouts of its derived components.
+        """
+        try:
+            return self._layout_hashes[xsd_type]
+        except KeyError:
+            pass
 
-    @filter_method
-    def is_vector_type(self, xsd_type):
-        return xsd_type.is_derived(self.schema.types['vectorType']) \
-            or xsd_type.is_derived(self.schema.types['integerVectorType'])
+        # Circular references are represented by the name of the type
+        self._layout_hashes[xsd_type] = hash_text(self.type_name(xsd_type))[:16]
+
+        chunks = [self.type_name(xsd_type)]
+        if xsd_type.is_complex():
+            for attribute in xsd_type.attributes.values():
+                chunks.append('@{}:{}:{}'.format(attribute.local_name, self.map_type(attribute),
+                                                 attribute.is_optional()))
+        if xsd_type.has_complex_content():
+            for element in xsd_type.content.iter_elements():
+                chunks.append('{}:{}:{}-{}'.format(element.local_name, self.map_type(element),
+                                                   element.min_occurs, element.max_occurs))
+                if element.type.is_complex():
+                    chunks.append(self.get_layout_hash(element.type))
+        if xsd_type.is_extension():
+            chunks.append('={}'.format(self.map_type(xsd_type.base_type)))
+
+        layout_hash = self._layout_hashes[xsd_type] = hash_text(*chunks)[:16]
+        return layout_hash
+
+    def get_tag_names(self):
+        """
+        Returns the sorted local names of the elements of the schema, that
+        are the tags of the compact types layout.
+        """
+        names = {x.local_name for x in self.schema.elements.values()}
+        for xsd_type in self.schema.complex_types:
+            if xsd_type.has_complex_content():
+                names.update(x.local_name for x in xsd_type.content.iter_elements())
+        return sorted(names)
+
+    def _layout_fortran_type(self, xsd_type):
+        fortran_type = super(QEFortranGenerator, self).map_type(xsd_type)
+        if self.options['types_layout'] != 'compact' or \
+                not self._string_pattern.match(fortran_type):
+            return fortran_type
+        elif self._is_string_enumeration(xsd_type):
+            return 'INTEGER'
+        return 'CHARACTER(len=:), ALLOCATABLE'
 
     @staticmethod
-    @filter_method
-    def has_multi_sequence(xsd_type):
-        if xsd_type.has_simple_content():
+    def _is_string_enumeration(xsd_type):
+        # Only named types, that have a table of values in the types module
+        if not xsd_type.local_name or not xsd_type.is_simple() \
+                or not getattr(xsd_type, 'enumeration', None):
             return False
-        return any(e.is_multiple() for e in xsd_type.content.iter_elements())
+        return xsd_type.primitive_type.local_name == 'string'
 
-    @filter_method
-    def init_fortran_type(self, xsd_type):
-        tmp = re.sub(r'LEN=[\d]+', 'LEN=*', self.map_type(xsd_type), flags=re.IGNORECASE)
-        return tmp.replace(', ALLOCATABLE', '')
+    def _is_derived_from(self, xsd_type, *names):
+        for name in names:
+            try:
+                if xsd_type.is_derived(self.schema.types[name]):
+                    return True
+            except KeyError:
+                continue
+        return False
+
+    def _is_qes_array_type(self, xsd_type):
+        if xsd_type.local_name in ("vectorType", "integerVectorType", "integerMatrixType"):
+            return True
+        return self._is_derived_from(
+            xsd_type, 'vectorType', 'integerVectorType', 'integerMatrixType'
+        )
+
+    def _attributes_list(self, xsd_type):
+        if not xsd_type.is_complex():
+            return ()
+
+        remove = []
+        if self._is_derived_from(xsd_type, 'matrixType', 'integerMatrixType'):
+            remove += ['rank', 'dims']
+        return tuple(_ for _ in xsd_type.attributes.values() if _.local_name not in remove)
+
+    def _compact_fields(self, xsd_type):
+        fields = []
+        if xsd_type.is_complex():
+            for attribute in xsd_type.attributes.values():
+                fields.append(self._compact_field(
+                    attribute, attribute.local_name, 'attribute',
+                    min_occurs=int(attribute.is_required()), optional=attribute.is_optional()
+                ))
+
+        if xsd_type.has_complex_content():
+            for element in xsd_type.content.iter_elements():
+                fields.append(self._compact_field(
+                    element, element.local_name, 'element',
+                    min_occurs=element.min_occurs, max_occurs=element.max_occurs,
+                    optional=element.min_occurs == 0
+                ))
+
+        if xsd_type.is_extension():
+            fields.append(self._compact_field(
+                xsd_type.base_type, self.type_name(xsd_type), 'content'
+            ))
+
+        # Allocatable arrays are sized by a preceding integer attribute
+        positions = {f.name: k for k, f in enumerate(fields, start=1) if f.role == 'attribute'}
+        if self._is_derived_from(xsd_type, 'matrixType', 'integerMatrixType'):
+            fields[positions['dims'] - 1].extent = positions['rank']
+            fields[-1].extent = positions['dims']
+        elif self._is_derived_from(xsd_type, 'vectorType', 'integerVectorType'):
+            fields[-1].extent = positions['size']
+
+        for field in fields:
+            if field.size < 0 and not field.extent and not field.is_multiple:
+                raise ValueError("compact code_mode: the extent of component {!r} of {!r} "
+                                 "is unknown".format(field.name, xsd_type))
+        return tuple(fields)
+
+    def _compact_field(self, obj, name, role, **kwargs):
+        xsd_type = obj if isinstance(obj, XsdType) else obj.type
+        if xsd_type.is_complex() and role != 'content':
+            if kwargs.get('max_occurs', 1) != 1:
+                kwargs['size'] = -1
+            return QEField(name, role, 'derived', xsd_type=xsd_type, **kwargs)
+        elif kwargs.get('max_occurs', 1) != 1:
+            raise ValueError("compact code_mode: multiple simple elements {!r} "
+                             "are not supported".format(obj))
+
+        match = self._component_pattern.match(self.map_type(xsd_type))
+        if match is None:
+            raise ValueError("compact code_mode: unsupported Fortran type {!r} "
+                             "of {!r}".format(self.map_type(xsd_type), obj))
+
+        kind = match.group(1).split('(')[0].lower()
+        if match.group(2) is None:
+            size = 0
+        elif kind not in ('integer', 'real'):
+            raise ValueError("compact code_mode: unsupported Fortran type {!r} "
+                             "of {!r}".format(self.map_type(xsd_type), obj))
+        elif match.group(2) == ':':
+            size = -1
+        else:
+            size = int(match.group(2))
+        return QEField(name, role, kind, size, **kwargs)
 
     @staticmethod
-    @filter_method
-    def optional(xsd_element):
-        return 'OPTIONAL,' if not xsd_element.min_occurs else ''
+    def _init_fortran_type(fortran_type):
+        tmp = re.sub(r'LEN=[\d:]+', 'LEN=*', fortran_type, flags=re.IGNORECASE)
+        return tmp.replace(', ALLOCATABLE', '')
 
     @staticmethod
-    @filter_method
-    def dimension(xsd_element):
-        if xsd_element.max_occurs in (0, 1):
-            return ''
-        elif xsd_element.min_occurs == xsd_element.max_occurs:
-            return 'DIMENSION({}),'.format(xsd_element.max_occurs)
-        else:
-            return 'DIMENSION(:),'
+    def _has_multi_sequence(xsd_type):
+        if xsd_type.has_simple_content():
+            return False
+        return any(e.is_multiple() for e in xsd_type.content.iter_elements())
 
     @staticmethod
-    @filter_method
-    def init_argument_line(xsd_type):
+    def _init_argument_line(xsd_type):
         line_head = []
         line_tail = []
         indent = len('  SUBROUTINE qes_init_' + xsd_type.local_name.replace('Type', ''))
@@ -143,9 +563,13 @@ class QEFortranGenerator(FortranGenerator):
         lines = []
         max_line = 90
         arglist = line_head + line_tail
-        lastindex = len(line_head + line_tail) - 1
-        for arg in line_head + line_tail:
-            if len(line) + indent > max_line and arglist.index(arg) < lastindex:
+        # Position of the first occurrence of each argument
+        positions = {}
+        for k, arg in enumerate(arglist):
+            positions.setdefault(arg, k)
+        lastindex = len(arglist) - 1
+        for arg in arglist:
+            if len(line) + indent > max_line and positions[arg] < lastindex:
                 line = line + ',&'
                 lines.append(line)
                 line = ''
@@ -163,10 +587,173 @@ class QEFortranGenerator(FortranGenerator):
             lines.append(line)
         return '\n'.join(lines)
 
+    @staticmethod
+    @filter_method
+    def bcast_function_name(xsd_type):
+        return 'qes_bcast_' + xsd_type.local_name.replace('Type', '')
+
+    @staticmethod
+    @filter_method
+    def init_function_name(xsd_type):
+        name = xsd_type.local_name
+        if name in ['matrixType', 'integerMatrixType']:
+            return ', '.join(
+                'qes_init_' + name.replace('Type', '_%d' % k) for k in (1, 2, 3)
+            )
+        elif xsd_type.is_complex():
+            return 'qes_init_' + name.replace('Type', '')
+        else:
+            return None
+
+    @filter_method
+    def is_qes_array_type(self, xsd_type):
+        return self.get_type_info(xsd_type).is_array
+
+    @staticmethod
+    @filter_method
+    def is_qes_type(xsd_type):
+        return xsd_type.target_namespace == QE_NAMESPACE
+
+    @filter_method
+    def is_matrix_type(self, xsd_type):
+        return self.get_type_info(xsd_type).is_matrix
+
+    @filter_method
+    def is_vector_type(self, xsd_type):
+        return self.get_type_info(xsd_type).is_vector
+
+    @filter_method
+    def has_multi_sequence(self, xsd_type):
+        return self.get_type_info(xsd_type).multi_sequence
+
+    @filter_method
+    def init_fortran_type(self, xsd_type):
+        if isinstance(xsd_type, (XsdAttribute, XsdElement)):
+            xsd_type = xsd_type.type
+        return self.get_type_info(xsd_type).init_fortran_type
+
+    @staticmethod
+    @filter_method
+    def optional(xsd_element):
+        return 'OPTIONAL,' if not xsd_element.min_occurs else ''
+
+    @staticmethod
+    @filter_method
+    def dimension(xsd_element):
+        if xsd_element.max_occurs in (0, 1):
+            return ''
+        elif xsd_element.min_occurs == xsd_element.max_occurs:
+            return 'DIMENSION({}),'.format(xsd_element.max_occurs)
+        else:
+            return 'DIMENSION(:),'
+
+    @filter_method
+    def init_argument_line(self, xsd_type):
+        init_argument_line = self.get_type_info(xsd_type).init_argument_line
+        if init_argument_line is None:
+            return self._init_argument_line(xsd_type)
+        return init_argument_line
+
     @filter_method
     def attributes_list(self, xsd_type):
-        remove = []
-        if xsd_type.is_derived(self.schema.types['matrixType']) \
-                or xsd_type.is_derived(self.schema.types['integerMatrixType']):
-            remove += ['rank', 'dims']
-        return (_ for _ in xsd_type.attributes.values() if _.local_name not in remove)
+        return iter(self.get_type_info(xsd_type).attributes)
+
+    @filter_method
+    def compact_fields(self, xsd_type):
+        type_info = self.get_type_info(xsd_type)
+        if type_info.fields is None:
+            type_info.fields = self._compact_fields(xsd_type)
+        return type_info.fields
+
+    @filter_method
+    def type_id(self, xsd_type):
+        return self._type_ids[xsd_type]
+
+    @filter_method
+    def layout_hash(self, xsd_type):
+        return self.get_layout_hash(xsd_type)
+
+    @staticmethod
+    @filter_method
+    def stream_element(xsd_type):
+        """
+        Returns the child element whose items are appended by the streaming
+        writers of a type, `None` if the type has no streaming writers. It's
+        the only unbounded child of a QE type in a sequence of elements.
+        """
+        if not xsd_type.has_complex_content() or xsd_type.content.model != 'sequence' or \
+                not all(isinstance(x, XsdElement) for x in xsd_type.content):
+            return None
+        elements = [e for e in xsd_type.content
+                    if e.max_occurs is None and e.type.is_complex()]
+        elements = [e for e in elements if e.type.target_namespace == QE_NAMESPACE]
+        return elements[0] if len(elements) == 1 else None
+
+    @classmethod
+    @filter_method
+    def format_width(cls, edit_descriptor, integer=False):
+        """
+        Returns the maximum width of a value written with a Fortran edit
+        descriptor, `None` if the descriptor is not supported or the width
+        is not bounded, like for a real written with a zero width.
+
+        :param edit_descriptor: the edit descriptor, eg. 'ES24.15E3'.
+        :param integer: if `True` the values are default integers.
+        """
+        match = cls._edit_descriptor_pattern.match(edit_descriptor)
+        if match is None:
+            return None
+        width = int(match.group(2))
+        if width > 0:
+            return width
+        elif integer:
+            return cls._integer_widths.get(match.group(1).upper())
+        return None
+
+    @filter_method
+    def enum_type(self, obj):
+        """
+        Returns the XSD type of a component stored as an integer id of a string
+        enumeration, `None` if the component is not stored as an enumeration.
+        """
+        xsd_type = obj.type if isinstance(obj, (XsdAttribute, XsdElement)) else obj
+        if self._is_string_enumeration(xsd_type) and self.map_type(xsd_type) == 'INTEGER':
+            return xsd_type
+        return None
+
+    @filter_method
+    def enum_constants(self, xsd_type):
+        """Returns the names of the Fortran constants of the values of an enumeration."""
+        prefix = 'qes_{}_'.format(self.type_name(xsd_type))
+        names = []
+        for value in xsd_type.enumeration:
+            name = prefix + re.sub(r'\W', '_', value)
+            if name.lower() in (x.lower() for x in names):
+                name += '_{}'.format(len(names) + 1)
+            names.append(name)
+        return names
+
+    @filter_method
+    def tag_names(self, schema):
+        return self.get_tag_names()
+
+    @staticmethod
+    @filter_method
+    def string_array(values, indent=4, width=100):
+        """
+        Formats a sequence of strings as a Fortran array constructor of blank
+        padded strings, with continuation lines.
+        """
+        length = max((len(x) for x in values), default=1)
+        lines = ['[ CHARACTER(LEN={}) :: &'.format(length)]
+        line = ''
+        for k, value in enumerate(values, start=1):
+            item = "'{}'".format(value.replace("'", "''"))
+            item += ' ]' if k == len(values) else ','
+            if line and len(line) + len(item) + 1 > width:
+                lines.append(' ' * indent + line + ' &')
+                line = item
+            else:
+                line = '{} {}'.format(line, item) if line else item
+        lines.append(' ' * indent + line)
+        return '\n'.join(lines)
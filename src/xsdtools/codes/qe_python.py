@@ -0,0 +1,83 @@
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+import keyword
+
+from xmlschema.extras.codegen import filter_method
+
+from ..python_generator import PythonGenerator
+from .qe import QE_NAMESPACE
+
+
+class QEPythonGenerator(PythonGenerator):
+    """
+    A Python code generator for Quantum ESPRESSO. Renders a module with a
+    class with `__slots__` for each complex type of the schema, that stores
+    vectors and matrices as NumPy arrays.
+    """
+    searchpaths = ['templates/qe_python/']
+
+    def __init__(self, schema, searchpath=None, types_map=None,
+                 bytecode_cache=None, precompiled=False, options=None):
+        super(QEPythonGenerator, self).__init__(
+            schema, searchpath, types_map, bytecode_cache, precompiled, options
+        )
+        assert self.schema.target_namespace == QE_NAMESPACE
+
+    @staticmethod
+    @filter_method
+    def python_name(obj):
+        name = PythonGenerator.name(obj)
+        return name + '_' if keyword.iskeyword(name) else name
+
+    @staticmethod
+    @filter_method
+    def is_qes_type(xsd_type):
+        return xsd_type.target_namespace == QE_NAMESPACE
+
+    @filter_method
+    def value_parser(self, xsd_type):
+        """The name of the function that converts a text to a value of the type."""
+        kind, is_list = self.get_value_kind(xsd_type)
+        if is_list:
+            return '_{}_array'.format(kind)
+        return '_bool' if kind == 'bool' else kind
+
+    @filter_method
+    def value_formatter(self, xsd_type):
+        """The name of the function that converts a value of the type to a text."""
+        kind, is_list = self.get_value_kind(xsd_type)
+        if is_list:
+            return '_format_array'
+        return 'str' if kind in ('int', 'str') else '_format_' + kind
+
+    @filter_method
+    def value_dtype(self, xsd_type):
+        return self.get_value_kind(xsd_type)[0]
+
+    @filter_method
+    def slot_attributes(self, xsd_type):
+        """
+        The attributes of a complex type that are stored in slots. Shape
+        attributes of vectors and matrices are derived from the arrays.
+        """
+        if self.is_derived(xsd_type, 'qes:matrixType', 'qes:integerMatrixType'):
+            exclude = ('rank', 'dims')
+        elif self.is_derived(xsd_type, 'qes:vectorType', 'qes:integerVectorType'):
+            exclude = ('size',)
+        else:
+            exclude = ()
+        return [x for x in xsd_type.attributes.values() if x.local_name not in exclude]
+
+    @filter_method
+    def slot_names(self, xsd_type):
+        """The names of the slots of the class of a complex type."""
+        names = [self.python_name(x) for x in self.slot_attributes(xsd_type)]
+        names.extend(self.python_name(x) for x in self.child_elements(xsd_type))
+        if xsd_type.has_simple_content():
+            names.append('value')
+        return names
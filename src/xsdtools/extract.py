@@ -0,0 +1,234 @@
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+"""
+Streaming extraction of elements from XML instances, decoded according to their
+XSD types, eg. the forces of the steps of a QE run::
+
+    for path, forces in iter_extract(schema, 'pwscf.xml', 'espresso/step/forces'):
+        print(forces.shape)
+
+The instance is parsed incrementally and the elements that are out of the
+extracted subtrees are discarded as they are parsed, so the memory used
+doesn't depend on the size of the instance.
+"""
+from xml.etree import ElementTree
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SHAPE_ATTRIBUTES = frozenset(('rank', 'dims', 'order', 'size'))
+"""Attributes that only describe the shape of an array, as in QE vectors and matrices."""
+
+
+def local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+class SchemaExtractor(object):
+    """
+    Extracts the elements of XML instances that match a set of paths, decoding
+    them according to the XSD types of a schema.
+
+    Numeric list contents are decoded to NumPy arrays. Elements of a complex
+    type with array content and only shape attributes, as QE *vectorType* and
+    *matrixType*, are decoded to arrays shaped from their *dims* and *order*
+    attributes. Other complex elements are decoded to dictionaries, with the
+    attributes prefixed by '@', the simple content as '$' and the children
+    by their names, in lists for repeated children.
+
+    :param schema: an XMLSchema instance.
+    :param paths: an element path or a list of element paths. A path is \
+    made of the local names of the elements from the root, separated by \
+    slashes, a '*' matches any name, eg. 'espresso/step/forces'.
+    """
+    __slots__ = ('schema', 'paths', '_children', '_dtypes')
+
+    def __init__(self, schema, paths):
+        if np is None:
+            raise ImportError("the extraction of data requires NumPy")
+        if isinstance(paths, str):
+            paths = [paths]
+
+        self.schema = schema
+        self.paths = [tuple(x.strip('/').split('/')) for x in paths]
+        if not self.paths or not all(all(x) for x in self.paths):
+            raise ValueError("invalid element paths {!r}".format(paths))
+        self._children = {}
+        self._dtypes = {}
+
+    def __repr__(self):
+        return '%s(paths=%r)' % (self.__class__.__name__, ['/'.join(x) for x in self.paths])
+
+    def iter_extract(self, source):
+        """
+        Parses an XML source incrementally, yielding the matching elements.
+
+        :param source: a file path or a file-like object.
+        :return: an iterator of couples with the path and the decoded value \
+        of each matching element, in document order.
+        """
+        names = []
+        ancestors = []
+        xsd_elements = []
+        candidates = [self.paths]  # the paths that can match each open element
+        match_depth = None
+
+        for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                depth = len(names)
+                name = local_name(elem.tag)
+                names.append(name)
+                ancestors.append(elem)
+                if match_depth is not None:
+                    continue  # in an extracted subtree, decoded at its end
+
+                paths = [x for x in candidates[-1] if x[depth] == name or x[depth] == '*']
+                if not paths:
+                    xsd_elements.append(None)
+                elif depth:
+                    xsd_elements.append(self.get_child(xsd_elements[-1], elem.tag))
+                else:
+                    xsd_elements.append(self.schema.maps.elements.get(elem.tag))
+
+                if any(len(x) == depth + 1 for x in paths):
+                    match_depth = depth + 1
+                candidates.append([x for x in paths if len(x) > depth + 1])
+                continue
+
+            ancestors.pop()
+            if match_depth is None or match_depth == len(names):
+                candidates.pop()
+                xsd_element = xsd_elements.pop()
+                if match_depth is not None:
+                    yield '/'.join(names), self.decode(elem, xsd_element)
+                    match_depth = None
+            names.pop()
+
+            if match_depth is None:
+                # Out of an extracted subtree: discard the element
+                elem.clear()
+                if ancestors:
+                    ancestors[-1].remove(elem)
+
+    def get_child(self, xsd_element, tag):
+        """Returns the XSD element of a child, `None` if it's not declared."""
+        if xsd_element is None:
+            return None
+
+        xsd_type = xsd_element.type
+        try:
+            children = self._children[xsd_type]
+        except KeyError:
+            children = self._children[xsd_type] = {}
+            if xsd_type.has_complex_content():
+                for child in xsd_type.content.iter_elements():
+                    children[child.name] = child
+        return children.get(tag)
+
+    def get_dtype(self, simple_type):
+        """Returns the NumPy dtype of a numeric list type, `None` for other types."""
+        try:
+            return self._dtypes[simple_type]
+        except KeyError:
+            pass
+
+        item_type = simple_type
+        while item_type is not None and not hasattr(item_type, 'item_type'):
+            item_type = getattr(item_type, 'base_type', None)
+
+        dtype = None
+        if item_type is not None:
+            item_type = item_type.item_type
+            types = self.schema.meta_schema.types
+            if item_type.is_derived(types['integer']):
+                dtype = np.int64
+            elif any(item_type.is_derived(types[x]) for x in ('double', 'float', 'decimal')):
+                dtype = np.float64
+
+        self._dtypes[simple_type] = dtype
+        return dtype
+
+    def decode(self, elem, xsd_element):
+        """
+        Decodes an element and its subtree according to an XSD element.
+
+        :param elem: an ElementTree element.
+        :param xsd_element: the XSD element, `None` for an undeclared element, \
+        whose attributes and text are decoded as strings.
+        """
+        xsd_type = None if xsd_element is None else xsd_element.type
+        if xsd_type is not None and xsd_type.is_simple():
+            return self.decode_text(elem.text, xsd_type)
+
+        data = {}
+        for name, value in elem.attrib.items():
+            xsd_attribute = None if xsd_type is None else xsd_type.attributes.get(name)
+            data['@' + name] = value if xsd_attribute is None else xsd_attribute.type.decode(value)
+
+        if xsd_type is not None and xsd_type.has_simple_content():
+            value = self.decode_text(elem.text, xsd_type.content)
+            if not isinstance(value, np.ndarray) or not SHAPE_ATTRIBUTES.issuperset(
+                    local_name(x) for x in xsd_type.attributes):
+                data['$'] = value
+                return data
+
+            # An array with only shape attributes
+            try:
+                dims = data['@dims']
+            except KeyError:
+                return value
+            order = data.get('@order')
+            if order is None and 'order' in xsd_type.attributes:
+                order = xsd_type.attributes['order'].default
+            return value.reshape(dims, order='C' if order == 'C' else 'F')
+
+        for child in elem:
+            xsd_child = self.get_child(xsd_element, child.tag)
+            name = local_name(child.tag)
+            value = self.decode(child, xsd_child)
+            if xsd_child is None or xsd_child.is_single():
+                if name not in data:
+                    data[name] = value
+                    continue
+                elif not isinstance(data[name], list):
+                    data[name] = [data[name]]
+            data.setdefault(name, []).append(value)
+
+        if not data and xsd_type is None:
+            return elem.text
+        return data
+
+    def decode_text(self, text, simple_type):
+        """Decodes the text of an element according to a simple type."""
+        dtype = self.get_dtype(simple_type)
+        if dtype is not None:
+            return np.array((text or '').split(), dtype=dtype)
+        return simple_type.decode(text if text is not None else '')
+
+
+def iter_extract(schema, source, paths):
+    """
+    Iterates the elements of an XML source that match the paths, yielding
+    couples with the path and the decoded value of each element. See the
+    class *SchemaExtractor* for the syntax of the paths and the decoding.
+    """
+    return SchemaExtractor(schema, paths).iter_extract(source)
+
+
+def extract(schema, source, paths):
+    """
+    Extracts the elements of an XML source that match the paths, returning
+    a dictionary that maps the path of the elements to the list of their
+    decoded values, in document order.
+    """
+    data = {}
+    for path, value in iter_extract(schema, source, paths):
+        data.setdefault(path, []).append(value)
+    return data
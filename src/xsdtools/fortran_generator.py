@@ -5,7 +5,7 @@
 # See the file 'LICENSE' in the root directory of the present distribution,
 # or https://opensource.org/licenses/BSD-3-Clause
 #
-from xmlschema.extras.codegen import AbstractGenerator
+from .abstract_generator import AbstractGenerator
 
 
 class FortranGenerator(AbstractGenerator):
@@ -0,0 +1,232 @@
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+"""
+Helpers for splitting generated Fortran modules into Fortran 2008 submodules
+and for building the dependencies of the generated files.
+"""
+import re
+from pathlib import Path
+
+_MODULE_PATTERN = re.compile(r'^\s*MODULE\s+(\w+)\s*$', re.IGNORECASE)
+_SUBMODULE_PATTERN = re.compile(r'^\s*SUBMODULE\s*\(\s*(\w+)', re.IGNORECASE)
+_USE_PATTERN = re.compile(r'^\s*USE\s+(\w+)', re.IGNORECASE)
+_CONTAINS_PATTERN = re.compile(r'^\s*CONTAINS\s*$', re.IGNORECASE)
+_SUBROUTINE_PATTERN = re.compile(r'^(\s*)((?:RECURSIVE\s+)?SUBROUTINE\s+(\w+).*)$', re.IGNORECASE)
+_END_SUBROUTINE_PATTERN = re.compile(r'^\s*END\s*SUBROUTINE\b', re.IGNORECASE)
+_DECLARATION_PATTERN = re.compile(r'^\s*[^!\s].*::(.*)$')
+_EMPTY_COMMENT_PATTERN = re.compile(r'^\s*!\s*$')
+
+
+def _statement_lines(lines, start):
+    """Returns the index after the last continuation line of a statement."""
+    stop = start + 1
+    while lines[stop - 1].rstrip().endswith('&') and stop < len(lines):
+        stop += 1
+    return stop
+
+
+def _entity_names(text):
+    """Returns the names of the entities of a list, skipping bounds and initializers."""
+    names, depth, start = [], 0, 0
+    for k, char in enumerate(text + ','):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ',' and not depth:
+            match = re.match(r'\s*(\w+)', text[start:k])
+            if match is not None:
+                names.append(match.group(1).lower())
+            start = k + 1
+    return names
+
+
+def wrap_line(line, width=132):
+    """Splits a free form source line longer than *width* with continuation lines."""
+    indent = line[:len(line) - len(line.lstrip())] + '    '
+    lines = []
+    while len(line) > width:
+        position = line.rfind(', ', 0, width - 2)
+        if position <= len(indent):
+            break
+        lines.append(line[:position + 1] + ' &')
+        line = indent + line[position + 2:]
+    lines.append(line)
+    return lines
+
+
+def get_interface_body(lines):
+    """
+    Returns the lines of the interface body of a separate module procedure,
+    from the lines of a subroutine. The interface is made of the SUBROUTINE
+    statement and of the declarations of the dummy arguments.
+    """
+    match = _SUBROUTINE_PATTERN.match(lines[0])
+    indent, name = match.group(1), match.group(3)
+
+    stop = _statement_lines(lines, 0)
+    body = wrap_line('{}MODULE {}'.format(indent, match.group(2).strip()))
+    body.extend(x.rstrip() for x in lines[1:stop])
+    body.append(indent + '  IMPLICIT NONE')
+
+    header = ' '.join(x.rstrip().rstrip('&') for x in lines[:stop])
+    arguments = re.search(r'\((.*)\)', header)
+    arguments = set(_entity_names(arguments.group(1))) if arguments else set()
+
+    k = stop
+    while k < len(lines):
+        stop = _statement_lines(lines, k)
+        statement = ' '.join(x.rstrip().rstrip('&') for x in lines[k:stop])
+        match = _DECLARATION_PATTERN.match(statement)
+        if match is not None and arguments.intersection(_entity_names(match.group(1))):
+            body.extend(x.rstrip() for x in lines[k:stop])
+        k = stop
+
+    body.append('{}END SUBROUTINE {}'.format(indent, name))
+    return body
+
+
+def split_module(text, get_group, group_size):
+    """
+    Splits the source of a Fortran module into a module with the interfaces
+    of its separate module procedures and submodules with their bodies.
+
+    :param text: the source of the module.
+    :param get_group: a function that maps the name of a subroutine of the \
+    module to a group key, or to `None` for subroutines that stay in the module.
+    :param group_size: the maximum number of groups of subroutines of \
+    a submodule. Groups are taken in the order of their subroutines.
+    :return: a couple with the source of the module and a list of couples \
+    with the names and the sources of the submodules, or `None` if the \
+    module has no subroutines to move into submodules.
+    """
+    lines = text.split('\n')
+    module_line = contains_line = None
+    for k, line in enumerate(lines):
+        if module_line is None:
+            if _MODULE_PATTERN.match(line):
+                module_line = k
+        elif _CONTAINS_PATTERN.match(line):
+            contains_line = k
+            break
+    else:
+        return None
+
+    procedures = []
+    k = contains_line + 1
+    while k < len(lines):
+        match = _SUBROUTINE_PATTERN.match(lines[k])
+        if match is None:
+            k += 1
+            continue
+
+        start = k
+        while not _END_SUBROUTINE_PATTERN.match(lines[k]):
+            k += 1
+        k += 1
+        key = get_group(match.group(3))
+        if key is not None:
+            procedures.append((key, start, k))
+
+    if not procedures:
+        return None
+
+    module_name = _MODULE_PATTERN.match(lines[module_line]).group(1)
+    prefix = module_name[:-7] if module_name.lower().endswith('_module') else module_name
+    indent = lines[contains_line][:-len(lines[contains_line].lstrip())]
+
+    # The module: interfaces before CONTAINS, without the moved subroutines
+    moved = set()
+    interfaces = [indent + 'INTERFACE']
+    for _, start, stop in procedures:
+        moved.update(range(start, stop))
+        interfaces.extend('  ' + x for x in get_interface_body(lines[start:stop]))
+    interfaces.extend((indent + 'END INTERFACE', indent + '!'))
+
+    module_lines = lines[:contains_line] + interfaces + [lines[contains_line]]
+    for k in range(contains_line + 1, len(lines)):
+        if k in moved:
+            continue
+        elif _EMPTY_COMMENT_PATTERN.match(lines[k]) and \
+                _EMPTY_COMMENT_PATTERN.match(module_lines[-1]):
+            continue  # collapse the separators of the moved subroutines
+        module_lines.append(lines[k])
+
+    # The submodules, with the groups of subroutines in order
+    keys = []
+    for key, _, _ in procedures:
+        if key not in keys:
+            keys.append(key)
+
+    submodules = []
+    for index, k in enumerate(range(0, len(keys), group_size), start=1):
+        group = set(keys[k:k + group_size])
+        name = '{}_submodule_{}'.format(prefix, index)
+        submodule_lines = lines[:module_line]
+        submodule_lines.extend((
+            'SUBMODULE ({}) {}'.format(module_name, name),
+            indent + '!',
+            indent + "! Auto-generated code: don't edit this file",
+            indent + '!',
+            indent + 'IMPLICIT NONE',
+            indent + '!',
+            lines[contains_line],
+        ))
+        for key, start, stop in procedures:
+            if key in group:
+                match = _SUBROUTINE_PATTERN.match(lines[start])
+                submodule_lines.append(indent + '!')
+                submodule_lines.extend(
+                    wrap_line('{}MODULE {}'.format(match.group(1), match.group(2)))
+                )
+                submodule_lines.extend(lines[start + 1:stop])
+        submodule_lines.extend((indent + '!', 'END SUBMODULE {}'.format(name), ''))
+        submodules.append((name, '\n'.join(submodule_lines)))
+
+    return '\n'.join(module_lines), submodules
+
+
+def get_dependencies(paths):
+    """
+    Returns the dependencies between Fortran source files, from their USE
+    statements and from the parent modules of their submodules. Modules
+    that are not defined by the provided files are ignored.
+
+    :param paths: the paths of the source files.
+    :return: a dictionary that maps each file to the sorted list of the \
+    files that it depends on.
+    """
+    modules = {}
+    used = {}
+    for path in paths:
+        path = Path(path)
+        used[path] = names = set()
+        with path.open() as fp:
+            for line in fp:
+                match = _MODULE_PATTERN.match(line)
+                if match is not None:
+                    modules[match.group(1).lower()] = path
+                    continue
+                match = _SUBMODULE_PATTERN.match(line) or _USE_PATTERN.match(line)
+                if match is not None:
+                    names.add(match.group(1).lower())
+
+    return {
+        path: sorted({modules[x] for x in names if x in modules} - {path})
+        for path, names in used.items()
+    }
+
+
+def format_make_dependencies(dependencies, suffix='.o'):
+    """Formats the dependencies between source files as rules for make."""
+    lines = []
+    for path, depends in sorted(dependencies.items()):
+        for item in depends:
+            lines.append('{} : {}'.format(path.with_suffix(suffix).name,
+                                          item.with_suffix(suffix).name))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,159 @@
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+logger = logging.getLogger('xsdtools')
+
+MANIFEST_FILENAME = '.xsdtools-manifest.json'
+FRAGMENTS_FILENAME = '.xsdtools-fragments.json'
+
+
+def hash_text(*chunks):
+    """Returns the SHA-256 hex digest of a sequence of strings."""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def hash_content(chunks):
+    """Returns the SHA-256 hex digest of a text provided as a sequence of chunks."""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def hash_file(path, block_size=1 << 16):
+    """Returns the SHA-256 hex digest of the content of a text file, reading it by blocks."""
+    with open(path) as fp:
+        return hash_content(iter(lambda: fp.read(block_size), ''))
+
+
+class RenderManifest(object):
+    """
+    A manifest of rendered files, stored as a JSON file in the output
+    directory. For each output file the manifest records the hash of
+    the rendering inputs (schema sources, template sources and types
+    map) and the hash of the content written to the file.
+
+    :param output_dir: the output directory of the rendered files.
+    :param filename: the name of the manifest file.
+    """
+    version = 2
+
+    def __init__(self, output_dir, filename=MANIFEST_FILENAME):
+        self.path = Path(output_dir).joinpath(filename)
+        self.outputs = {}
+
+    def __repr__(self):
+        return '%s(path=%r)' % (self.__class__.__name__, str(self.path))
+
+    def load(self):
+        try:
+            with self.path.open() as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as err:
+            logger.warning("ignore invalid manifest %r: %s", str(self.path), str(err))
+            return
+
+        if isinstance(data, dict) and data.get('version') == self.version:
+            self.outputs.update(data.get('outputs', {}))
+
+    def save(self):
+        data = {'version': self.version, 'outputs': self.outputs}
+        with self.path.open('w') as fp:
+            json.dump(data, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+
+    def __contains__(self, output_file):
+        return Path(output_file).name in self.outputs
+
+    def is_up_to_date(self, output_file, inputs_hash):
+        """
+        Returns `True` if the output file has been rendered from the same
+        inputs and its content has not been changed after rendering.
+        """
+        output_file = Path(output_file)
+        try:
+            record = self.outputs[output_file.name]
+            if record.get('inputs') != inputs_hash:
+                return False
+            return record.get('hash') == hash_file(output_file)
+        except (KeyError, OSError):
+            return False
+
+    def update(self, output_file, template_name, inputs_hash, content_hash):
+        self.outputs[Path(output_file).name] = {
+            'template': template_name,
+            'inputs': inputs_hash,
+            'hash': content_hash,
+        }
+
+
+class FragmentCache(object):
+    """
+    A cache of the rendered fragments of templates, stored as a JSON file in
+    the output directory. Fragments are grouped by the template that renders
+    them and are looked up by a hash of their inputs. Saving the cache replaces
+    the groups of the templates rendered since loading, so fragments that are
+    no longer used are discarded.
+
+    :param output_dir: the output directory of the rendered files.
+    :param filename: the name of the cache file.
+    """
+    version = 1
+
+    def __init__(self, output_dir, filename=FRAGMENTS_FILENAME):
+        self.path = Path(output_dir).joinpath(filename)
+        self.fragments = {}
+        self.rendered = {}
+        self.hits = self.misses = 0
+
+    def __repr__(self):
+        return '%s(path=%r)' % (self.__class__.__name__, str(self.path))
+
+    def load(self):
+        try:
+            with self.path.open() as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as err:
+            logger.warning("ignore invalid fragment cache %r: %s", str(self.path), str(err))
+            return
+
+        if isinstance(data, dict) and data.get('version') == self.version:
+            self.fragments.update(data.get('fragments', {}))
+
+    def save(self):
+        self.fragments.update(self.rendered)
+        self.rendered = {}
+        data = {'version': self.version, 'fragments': self.fragments}
+        with self.path.open('w') as fp:
+            json.dump(data, fp, indent=1, sort_keys=True)
+            fp.write('\n')
+
+    def get(self, template_name, key):
+        """Returns a cached fragment of a template or `None` if it's not cached."""
+        text = self.fragments.get(template_name, {}).get(key)
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    def add(self, template_name, key, text):
+        """Adds a fragment rendered by a template, that will be kept on saving."""
+        self.rendered.setdefault(template_name, {})[key] = text
@@ -0,0 +1,143 @@
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+import json
+from functools import wraps
+from time import perf_counter
+
+from jinja2 import Template
+
+
+class ProfileEntry(object):
+    """Collected statistics of a profiled filter, test or template."""
+    __slots__ = ('kind', 'name', 'calls', 'total_time', 'self_time')
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.calls = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+
+    def __repr__(self):
+        return '%s(kind=%r, name=%r, calls=%d)' % (
+            self.__class__.__name__, self.kind, self.name, self.calls
+        )
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class GeneratorProfiler(object):
+    """
+    Collects call counts and times of the filters, the tests and the
+    templates rendered by code generators. Total times include nested
+    calls (eg. sub-templates and filters called by a template), self
+    times exclude the time spent in the other profiled objects.
+    """
+    def __init__(self):
+        self.entries = {}
+        self._stack = []
+
+    def __repr__(self):
+        return '%s(entries=%d)' % (self.__class__.__name__, len(self.entries))
+
+    def reset(self):
+        self.entries.clear()
+
+    def get_entry(self, kind, name):
+        try:
+            return self.entries[kind, name]
+        except KeyError:
+            entry = self.entries[kind, name] = ProfileEntry(kind, name)
+            return entry
+
+    def _enter(self):
+        self._stack.append(0.0)
+        return perf_counter()
+
+    def _exit(self, entry, start_time):
+        elapsed = perf_counter() - start_time
+        nested_time = self._stack.pop()
+        entry.total_time += elapsed
+        entry.self_time += elapsed - nested_time
+        if self._stack:
+            self._stack[-1] += elapsed
+
+    def wrap_function(self, kind, name, func):
+        """Wraps a filter or test function for profiling its calls."""
+        entry = self.get_entry(kind, name)
+
+        @wraps(func)
+        def profiled_function(*args, **kwargs):
+            entry.calls += 1
+            start_time = self._enter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._exit(entry, start_time)
+
+        return profiled_function
+
+    def wrap_render_func(self, name, render_func):
+        """
+        Wraps the root render function of a template. The template code is
+        a generator, so only the time spent inside the generator is counted.
+        """
+        entry = self.get_entry('template', name)
+
+        def profiled_render_func(context):
+            entry.calls += 1
+            events = render_func(context)
+            while True:
+                start_time = self._enter()
+                try:
+                    event = next(events)
+                except StopIteration:
+                    return
+                finally:
+                    self._exit(entry, start_time)
+                yield event
+
+        return profiled_render_func
+
+    def get_stats(self, sort_by='total_time'):
+        """Returns a list of the collected entries, sorted in descending order."""
+        return sorted(self.entries.values(),
+                      key=lambda x: (-getattr(x, sort_by), x.kind, x.name))
+
+    def as_table(self, sort_by='total_time'):
+        lines = ['{:<10} {:<48} {:>8} {:>10} {:>10}'.format(
+            'kind', 'name', 'calls', 'total(s)', 'self(s)'
+        )]
+        for entry in self.get_stats(sort_by):
+            if entry.calls:
+                lines.append('{:<10} {:<48} {:>8} {:>10.4f} {:>10.4f}'.format(
+                    entry.kind, entry.name, entry.calls, entry.total_time, entry.self_time
+                ))
+        return '\n'.join(lines)
+
+    def as_json(self, sort_by='total_time'):
+        return json.dumps(
+            [x.as_dict() for x in self.get_stats(sort_by) if x.calls], indent=2
+        )
+
+
+class ProfiledTemplate(Template):
+    """
+    A template class that profiles its rendering if its environment
+    has a profiler, including the templates included or extended.
+    """
+    @classmethod
+    def _from_namespace(cls, environment, namespace, globals):
+        template = super(ProfiledTemplate, cls)._from_namespace(environment, namespace, globals)
+        profiler = getattr(environment, 'xsdtools_profiler', None)
+        if profiler is not None:
+            template.root_render_func = profiler.wrap_render_func(
+                template.name, template.root_render_func
+            )
+        return template
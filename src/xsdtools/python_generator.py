@@ -0,0 +1,16 @@
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+from xmlschema.extras import codegen
+
+from .abstract_generator import AbstractGenerator
+
+
+class PythonGenerator(AbstractGenerator, codegen.PythonGenerator):
+    """
+    Python code generic generator for XSD schemas.
+    """
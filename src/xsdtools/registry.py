@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+"""
+Registry of code generators, that maps the names used with the --generator
+option of the command line interface to generator classes. The classes are
+imported only when their name is resolved. Other packages can add generators
+with an entry point of the group *xsdtools.generators*, eg. in setup.py::
+
+    entry_points={
+        'xsdtools.generators': ['MyCode = mypackage.generators:MyCodeGenerator']
+    }
+"""
+import importlib
+
+ENTRY_POINTS_GROUP = 'xsdtools.generators'
+
+GENERATORS = {
+    'C': 'xsdtools.c_generator:CGenerator',
+    'Fortran': 'xsdtools.fortran_generator:FortranGenerator',
+    'Python': 'xsdtools.python_generator:PythonGenerator',
+    'QE': 'xsdtools.codes.qe:QEFortranGenerator',
+    'QE-Python': 'xsdtools.codes.qe_python:QEPythonGenerator',
+}
+
+
+def register_generator(name, target):
+    """
+    Registers a generator, replacing the generator registered with the same name.
+
+    :param name: the name of the generator.
+    :param target: the generator class or its reference as a string in the \
+    format 'module:ClassName', for importing it lazily.
+    """
+    GENERATORS[name] = target
+
+
+def iter_entry_points():
+    """Yields the entry points of the generators provided by installed packages."""
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        try:
+            from importlib_metadata import entry_points
+        except ImportError:
+            return
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        yield from eps.select(group=ENTRY_POINTS_GROUP)
+    else:
+        yield from eps.get(ENTRY_POINTS_GROUP, ())
+
+
+def get_generator_names():
+    """Returns the names of the registered generators and of the entry points."""
+    names = list(GENERATORS)
+    names.extend(ep.name for ep in iter_entry_points() if ep.name not in GENERATORS)
+    return names
+
+
+def get_generator_class(name):
+    """
+    Returns the generator class registered with a name, importing it if necessary.
+    Names not registered are looked up in entry points.
+
+    :param name: the name of the generator.
+    """
+    try:
+        target = GENERATORS[name]
+    except KeyError:
+        for entry_point in iter_entry_points():
+            if entry_point.name == name:
+                target = GENERATORS[name] = entry_point.load()
+                break
+        else:
+            raise ValueError("unknown generator {!r}, must be one of {!r}".format(
+                name, get_generator_names()
+            )) from None
+
+    if isinstance(target, str):
+        module_name, _, class_name = target.partition(':')
+        target = GENERATORS[name] = getattr(importlib.import_module(module_name), class_name)
+    return target
@@ -0,0 +1,180 @@
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+import os
+import time
+import logging
+from urllib.parse import unquote, urlsplit
+
+logger = logging.getLogger('xsdtools')
+
+
+def get_schema_paths(schema):
+    """
+    Returns the paths of the local files of a schema and of its imported and
+    included schemas. Meta-schemas and remote resources are not included.
+    """
+    meta_schema = schema.meta_schema
+    if meta_schema is None:
+        meta_schemas = set()
+    else:
+        meta_schemas = set(meta_schema.maps.iter_schemas())
+
+    paths = []
+    for xsd in schema.maps.iter_schemas():
+        if xsd in meta_schemas or not xsd.url:
+            continue
+        url_parts = urlsplit(xsd.url)
+        if url_parts.scheme in ('', 'file'):
+            paths.append(os.path.abspath(unquote(url_parts.path)))
+        elif len(url_parts.scheme) == 1:
+            paths.append(os.path.abspath(xsd.url))  # a Windows drive letter
+        else:
+            logger.debug("remote schema %r is not watched", xsd.url)
+    return paths
+
+
+def get_template_paths(generator):
+    """Returns the directories of the template loaders of a generator."""
+    loader = generator._env.loader
+    paths = []
+    for loader in getattr(loader, 'loaders', [loader]):
+        paths.extend(os.path.abspath(x) for x in getattr(loader, 'searchpath', ()))
+    return paths
+
+
+class FileWatcher(object):
+    """
+    Watches files and directories for changes, polling the modification times
+    and the sizes of the files. Directories are watched recursively, skipping
+    hidden files and directories. Works on any platform and doesn't require
+    any external service.
+
+    :param paths: the paths of the files and of the directories to watch.
+    :param interval: the polling interval in seconds.
+    :param exclude: directories not to watch, eg. the output directory \
+    when it's inside a watched directory.
+    """
+    def __init__(self, paths=(), interval=1.0, exclude=()):
+        self.paths = list(paths)
+        self.interval = interval
+        self.exclude = {os.path.abspath(x) for x in exclude}
+        self._status = self.scan()
+
+    def __repr__(self):
+        return '%s(paths=%r, interval=%r)' % (
+            self.__class__.__name__, self.paths, self.interval
+        )
+
+    def scan(self):
+        """Returns a dictionary with the status of each watched file."""
+        status = {}
+        for path in self.paths:
+            if not os.path.isdir(path):
+                self._add_status(status, path)
+                continue
+
+            for dirpath, dirnames, filenames in os.walk(path):
+                if os.path.abspath(dirpath) in self.exclude:
+                    dirnames.clear()
+                    continue
+                dirnames[:] = [x for x in dirnames if not x.startswith('.')]
+                for filename in filenames:
+                    if not filename.startswith('.'):
+                        self._add_status(status, os.path.join(dirpath, filename))
+        return status
+
+    @staticmethod
+    def _add_status(status, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            status[path] = None  # a missing file is a status too
+        else:
+            status[path] = stat.st_mtime_ns, stat.st_size
+
+    def set_paths(self, paths):
+        """Replaces the watched paths, changes of the new paths are detected from now."""
+        self.paths = list(paths)
+        self._status = self.scan()
+
+    def changes(self):
+        """Returns the set of the paths changed since the last call."""
+        status = self.scan()
+        changed = {path for path in status.keys() | self._status.keys()
+                   if status.get(path) != self._status.get(path)}
+        self._status = status
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Waits for changes, returning the set of changed paths. Returns an
+        empty set if a timeout in seconds is provided and it expires.
+        """
+        start = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            changed = self.changes()
+            if changed or timeout is not None and time.monotonic() - start >= timeout:
+                return changed
+
+
+def watch(load_schema, build_generators, render, interval=1.0, exclude=(), cycles=None):
+    """
+    Renders templates and keeps rendering them on changes of the schema sources
+    or of the templates. The schema and the generators are kept in memory between
+    renderings: the schema is reloaded only when one of its files changes, and
+    templates are compiled again only when their sources change.
+
+    :param load_schema: a function that loads the schema.
+    :param build_generators: a function that builds the list of the generators \
+    for a schema.
+    :param render: a function that renders the templates with a list of generators, \
+    the rendering should be incremental for updating only the outdated files.
+    :param interval: the polling interval in seconds.
+    :param exclude: directories not to watch, usually the output directory.
+    :param cycles: the maximum number of renderings after changes, for default \
+    watches until the process is interrupted.
+    """
+    schema = load_schema()
+    generators = build_generators(schema)
+    render(generators)
+
+    def watched_paths():
+        paths = get_schema_paths(schema)
+        for generator in generators:
+            paths.extend(x for x in get_template_paths(generator) if x not in paths)
+        return paths
+
+    watcher = FileWatcher(watched_paths(), interval, exclude)
+    logger.info("watching %d paths for changes, press Ctrl-C to stop", len(watcher.paths))
+
+    count = 0
+    while cycles is None or count < cycles:
+        changed = watcher.wait()
+        count += 1
+        logger.info("changed files: %s", ', '.join(sorted(changed)))
+
+        if not changed.isdisjoint(get_schema_paths(schema)):
+            try:
+                new_schema = load_schema()
+            except Exception as err:
+                logger.error("schema not reloaded: %s", err)
+                continue
+
+            if new_schema.target_namespace == schema.target_namespace:
+                for generator in generators:
+                    generator.set_schema(new_schema)
+            else:
+                generators = build_generators(new_schema)
+            schema = new_schema
+            watcher.set_paths(watched_paths())
+
+        try:
+            render(generators)
+        except Exception as err:
+            logger.error("rendering failed: %s", err)
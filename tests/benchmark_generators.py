@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020, Quantum Espresso Foundation and SISSA.
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the BSD 3-Clause license.
+# See the file 'LICENSE' in the root directory of the present distribution,
+# or https://opensource.org/licenses/BSD-3-Clause
+#
+"""
+Benchmarks for schema loading and for rendering of QE modules. Run from
+the root directory of the project with:
+
+  python -m tests.benchmark_generators [--repeat N] [--synthetic SIZE ...]
+
+Results are emitted as JSON, to stdout or to the file given with --output.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from pathlib import Path
+
+import jinja2
+import xmlschema
+
+import xsdtools
+from xsdtools import QEFortranGenerator
+from xsdtools.codes.qe import QE_NAMESPACE
+
+SCHEMAS_DIR = Path(__file__).absolute().parent.joinpath('schemas/qe')
+
+SAMPLE_SCHEMAS = ['qes.xsd', 'qes-refactored.xsd', 'ph_xmlschema.xsd']
+
+QE_MODULES = ['types', 'read', 'write', 'bcast', 'init', 'reset', 'libs']
+
+STARTUP_MODULES = ['xsdtools', 'xsdtools.__main__']
+
+# Maximum import time of the command line interface, in seconds
+STARTUP_BUDGET = 0.1
+
+SYNTHETIC_HEADER = """<?xml version="1.0"?>
+<schema xmlns="http://www.w3.org/2001/XMLSchema"
+    xmlns:qes="{0}" targetNamespace="{0}">
+  <element name="espresso" type="qes:rootType"/>
+  <simpleType name="integerListType">
+    <list itemType="integer"/>
+  </simpleType>
+  <simpleType name="doubleListType">
+    <list itemType="double"/>
+  </simpleType>
+  <simpleType name="d3vectorType">
+    <restriction base="qes:doubleListType">
+      <length value="3"/>
+    </restriction>
+  </simpleType>
+  <complexType name="vectorType">
+    <simpleContent>
+      <extension base="qes:doubleListType">
+        <attribute name="size" type="integer" use="required"/>
+      </extension>
+    </simpleContent>
+  </complexType>
+  <complexType name="integerVectorType">
+    <simpleContent>
+      <extension base="qes:integerListType">
+        <attribute name="size" type="integer" use="required"/>
+      </extension>
+    </simpleContent>
+  </complexType>
+  <complexType name="matrixType">
+    <simpleContent>
+      <extension base="qes:doubleListType">
+        <attribute name="rank" type="positiveInteger" use="required"/>
+        <attribute name="dims" type="qes:integerListType" use="required"/>
+        <attribute name="order" type="string"/>
+      </extension>
+    </simpleContent>
+  </complexType>
+  <complexType name="integerMatrixType">
+    <simpleContent>
+      <extension base="qes:integerListType">
+        <attribute name="rank" type="positiveInteger" use="required"/>
+        <attribute name="dims" type="qes:integerListType" use="required"/>
+        <attribute name="order" type="string"/>
+      </extension>
+    </simpleContent>
+  </complexType>
+"""
+
+ARRAY_BASE_TYPES = ['matrixType', 'vectorType', 'integerMatrixType', 'integerVectorType']
+
+
+def build_synthetic_schema(size, depth=4, fanout=4):
+    """
+    Builds the source of a synthetic schema in QE namespace, that has
+    about *size* complexTypes. Array types are derived from matrixType and
+    vectorType with extension chains of length *depth*, the other types have
+    sequences of *fanout* elements referring to the types defined before,
+    with optional and unbounded elements.
+
+    :param size: the approximate number of complexTypes.
+    :param depth: the length of the extension chains of array types.
+    :param fanout: the number of child elements of structured types.
+    :return: the source of the schema as a string.
+    """
+    lines = [SYNTHETIC_HEADER.format(QE_NAMESPACE)]
+    type_names = []
+
+    num_chains = max(1, size // (4 * depth))
+    for k in range(num_chains):
+        base_name = ARRAY_BASE_TYPES[k % len(ARRAY_BASE_TYPES)]
+        for level in range(depth):
+            name = 'array{}_{}Type'.format(k, level)
+            lines.append(
+                '  <complexType name="{}">\n'
+                '    <simpleContent>\n'
+                '      <extension base="qes:{}">\n'
+                '        <attribute name="attr{}" type="string"/>\n'
+                '      </extension>\n'
+                '    </simpleContent>\n'
+                '  </complexType>\n'.format(name, base_name, level)
+            )
+            base_name = name
+            type_names.append(name)
+
+    scalar_types = ['double', 'integer', 'string', 'boolean', 'qes:d3vectorType']
+    num_structs = max(1, size - len(type_names) - 1)
+    for k in range(num_structs):
+        name = 'struct{}Type'.format(k)
+        lines.append('  <complexType name="{}">\n    <sequence>\n'.format(name))
+        for j in range(fanout):
+            if type_names and j % 2 == 0:
+                child_type = 'qes:' + type_names[(k * fanout + j * 7) % len(type_names)]
+            else:
+                child_type = scalar_types[(k + j) % len(scalar_types)]
+
+            occurs = ['', ' minOccurs="0"', ' minOccurs="0" maxOccurs="unbounded"'][(k + j) % 3]
+            lines.append('      <element name="elem{}" type="{}"{}/>\n'.format(
+                j, child_type, occurs
+            ))
+        lines.append('    </sequence>\n'
+                     '    <attribute name="label" type="string"/>\n'
+                     '  </complexType>\n')
+        type_names.append(name)
+
+    lines.append('  <complexType name="rootType">\n    <sequence>\n')
+    for name in type_names[-fanout:]:
+        lines.append('      <element name="{0}" type="qes:{0}Type"/>\n'.format(name[:-4]))
+    lines.append('    </sequence>\n  </complexType>\n</schema>\n')
+    return ''.join(lines)
+
+
+def measure(func, repeat):
+    """Calls a function *repeat* times, returning the last result and the timings."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+def measure_import_time(module, repeat=3):
+    """
+    Measures the import time of a module in new interpreters, using the
+    `-X importtime` option of Python.
+
+    :param module: the name of the module.
+    :param repeat: the number of repetitions of the measure.
+    :return: a couple with the timings in seconds and the set of the names \
+    of the modules imported by the module.
+    """
+    pythonpath = [str(Path(xsdtools.__file__).parent.parent)]
+    if os.environ.get('PYTHONPATH'):
+        pythonpath.append(os.environ['PYTHONPATH'])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(pythonpath))
+
+    timings = []
+    modules = set()
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                  'import {}'.format(module)], env=env, check=True,
+                                 stderr=subprocess.PIPE, universal_newlines=True)
+        cumulative = 0
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or line.endswith('imported package'):
+                continue
+            _, cumulative_us, name = line[len('import time:'):].split('|')
+            modules.add(name.strip())
+            if name.strip() == module:
+                cumulative = int(cumulative_us) / 1e6
+        timings.append(cumulative)
+
+    return timings, modules
+
+
+def run_benchmarks(sources, repeat=3):
+    """
+    Runs the benchmarks on a list of schema sources.
+
+    :param sources: a list of couples with the name of the schema and \
+    its source (a path or a string).
+    :param repeat: the number of repetitions of each measure.
+    :return: a list of dictionaries with the results.
+    """
+    results = []
+
+    def add_result(schema_name, stage, timings, **kwargs):
+        result = {
+            'schema': schema_name,
+            'stage': stage,
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'timings': timings,
+        }
+        result.update(kwargs)
+        results.append(result)
+
+    for module in STARTUP_MODULES:
+        timings, modules = measure_import_time(module, repeat)
+        add_result(None, 'import', timings, module=module, modules=len(modules),
+                   budget=STARTUP_BUDGET)
+
+    for schema_name, source in sources:
+        schema, timings = measure(lambda: xmlschema.XMLSchema11(source), repeat)
+        add_result(schema_name, 'load', timings, types=len(schema.types))
+
+        if schema.target_namespace != QE_NAMESPACE:
+            continue  # QE templates apply only to schemas in QE namespace
+
+        generator, timings = measure(lambda: QEFortranGenerator(schema), repeat)
+        add_result(schema_name, 'construct', timings)
+
+        for module in QE_MODULES:
+            name = '{0}/qes_{0}_module.f90.jinja'.format(module)
+            generator.get_template(name)  # exclude template compilation
+
+            output, timings = measure(lambda: generator.render(name)[0], repeat)
+            add_result(schema_name, 'render', timings, module=module,
+                       lines=output.count('\n'))
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmarks for xsdtools generators.")
+    parser.add_argument('--repeat', type=int, default=3, metavar='N',
+                        help="number of repetitions of each measure, 3 by default.")
+    parser.add_argument('--synthetic', type=int, nargs='*', default=[], metavar='SIZE',
+                        help="sizes of synthetic schemas to add, in number of complexTypes.")
+    parser.add_argument('--depth', type=int, default=4,
+                        help="length of extension chains of synthetic schemas.")
+    parser.add_argument('--no-samples', dest='samples', action='store_false', default=True,
+                        help="skip the sample schemas.")
+    parser.add_argument('-o', '--output', type=str, default=None, metavar='FILE',
+                        help="write the JSON results to a file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    sources = []
+    if args.samples:
+        sources.extend((name, str(SCHEMAS_DIR.joinpath(name))) for name in SAMPLE_SCHEMAS)
+    for size in args.synthetic:
+        sources.append(('synthetic-{}'.format(size), build_synthetic_schema(size, args.depth)))
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'xmlschema': xmlschema.__version__,
+        'jinja2': jinja2.__version__,
+        'repeat': args.repeat,
+        'results': run_benchmarks(sources, args.repeat),
+    }
+
+    for result in report['results']:
+        if result['stage'] == 'import' and result['min'] > result['budget']:
+            sys.stderr.write("import of {!r} takes {:.3f}s, over the budget of {}s\n"
+                             .format(result['module'], result['min'], result['budget']))
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+            fp.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,15 +6,28 @@
 # or https://opensource.org/licenses/BSD-3-Clause
 #
 import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 from pathlib import Path
 import datetime
+import json
 
 import jinja2
 from xmlschema import XMLSchema
 from xmlschema.extras.codegen import AbstractGenerator, xsd_qname, filter_method, PythonGenerator
 
 # noinspection PyUnresolvedReferences
-from xsdtools import CGenerator, FortranGenerator
+from xsdtools import CGenerator, FortranGenerator, QEFortranGenerator, \
+    get_generator_class, register_generator
+from xsdtools.batch import BatchJob, load_batch, run_batch, format_summary
+from xsdtools.registry import GENERATORS
+from xsdtools.watch import FileWatcher, watch
+
+from .benchmark_generators import measure_import_time
 
 
 XSD_TEST = """
@@ -40,6 +53,71 @@ XSD_TEST = """
 </xs:schema>
 """
 
+XSD_READER_TEST = """
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns="http://codegen.test/1" targetNamespace="http://codegen.test/1">
+  <xs:element name="path" type="tns:pathType" />
+  <xs:simpleType name="doubleListType">
+    <xs:list itemType="xs:double" />
+  </xs:simpleType>
+  <xs:complexType name="pointType">
+    <xs:simpleContent>
+      <xs:extension base="tns:doubleListType">
+        <xs:attribute name="label" type="xs:string" />
+      </xs:extension>
+    </xs:simpleContent>
+  </xs:complexType>
+  <xs:complexType name="pathType">
+    <xs:sequence>
+      <xs:element name="closed" type="xs:boolean" minOccurs="0" />
+      <xs:element name="point" type="tns:pointType" maxOccurs="unbounded" />
+      <xs:element name="tag" type="xs:string" minOccurs="0" maxOccurs="unbounded" />
+    </xs:sequence>
+  </xs:complexType>
+</xs:schema>
+"""
+
+XML_READER_TEST = """<?xml version="1.0"?>
+<tns:path xmlns:tns="http://codegen.test/1">
+  <closed>true</closed>
+  <point label="A">1.5 2</point>
+  <unknown><point>0</point></unknown>
+  <point label="C">
+    -1E0 0
+  </point>
+  <tag>a</tag><tag>b</tag>
+</tns:path>
+"""
+
+READER_PROGRAM = r"""
+#include <stdio.h>
+#include "xsd_types.h"
+
+int main(int argc, char **argv)
+{
+    pathType path;
+    FILE *fp = fopen(argv[argc - 1], "r");
+    int error = xsd_read_path(fp, &path);
+
+    fclose(fp);
+    if (error) {
+        printf("%s\n", xsd_error_string(error));
+        return 1;
+    }
+    printf("%s %zu", path.has_closed && path.closed ? "closed" : "open", path.point_count);
+    for (size_t i = 0; i < path.point_count; i++) {
+        printf(" [%s]", path.point[i].label);
+        for (size_t j = 0; j < path.point[i].value_count; j++)
+            printf(" %g", path.point[i].value[j]);
+    }
+    for (size_t i = 0; i < path.tag_count; i++)
+        printf(" %s", path.tag[i]);
+    printf("\n");
+    xsd_free_pathType(&path);
+    return 0;
+}
+"""
+
 
 class DemoGenerator(AbstractGenerator):
     formal_language = 'Demo'
@@ -167,6 +245,43 @@ class TestCGenerator(TestAbstractGenerator):
     def test_language_type_filter(self):
         self.assertListEqual(self.generator.render('c_type_filter_test.jinja'), ['str'])
 
+    def test_render_reader(self):
+        schema = XMLSchema(XSD_READER_TEST)
+        generator = self.generator_class(schema, options={'prefix': 'tns'})
+        header = generator.render('xsd_types.h.jinja')[0]
+        source = generator.render('xsd_reader.c.jinja')[0]
+
+        self.assertIn('typedef struct pointType {\n'
+                      '    bool has_label;\n'
+                      '    char *label;\n'
+                      '    double *value;\n'
+                      '    size_t value_count;\n'
+                      '} pointType;', header)
+        self.assertIn('    pointType *point;\n    size_t point_count;\n', header)
+        self.assertIn('int tns_read_path(FILE *fp, pathType *obj);', header)
+        self.assertIn('    char **tag;\n    size_t tag_count;\n', header)
+        self.assertIn('return tns_read(fp, "http://codegen.test/1|path", '
+                      'TNS_TYPE_pathType, obj);', source)
+        self.assertIn('TNS_KIND_STRING_ITEM, &obj->tag, &obj->tag_count', source)
+
+    @unittest.skipIf(shutil.which('cc') is None or not os.path.isfile('/usr/include/expat.h'),
+                     "a C compiler and expat are required")
+    def test_reader_program(self):
+        generator = self.generator_class(XMLSchema(XSD_READER_TEST))
+        with tempfile.TemporaryDirectory() as build_dir:
+            generator.render_to_files(['xsd_types.h.jinja', 'xsd_reader.c.jinja'],
+                                      output_dir=build_dir)
+            Path(build_dir).joinpath('main.c').write_text(READER_PROGRAM)
+            Path(build_dir).joinpath('path.xml').write_text(XML_READER_TEST)
+            program = os.path.join(build_dir, 'main')
+            subprocess.run(['cc', '-std=c99', '-Wall', '-Werror', '-o', program, 'main.c',
+                            'xsd_reader.c', '-lexpat'], cwd=build_dir, check=True)
+            result = subprocess.run([program, 'path.xml'], cwd=build_dir,
+                                    stdout=subprocess.PIPE, universal_newlines=True)
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, 'closed 2 [A] 1.5 2 [C] -1 0 a b\n')
+
 
 class TestFortranGenerator(TestAbstractGenerator):
 
@@ -211,6 +326,46 @@ class TestFortranGenerator(TestAbstractGenerator):
         codegen = FortranGenerator(self.schema)
         codegen.render_to_files(names=[], output_dir='output/')
 
+    def test_sort_types_memoization(self):
+        codegen = FortranGenerator(self.schema)
+        xsd_types = self.schema.types
+        result = codegen.sort_types(xsd_types)
+        self.assertListEqual(
+            result, [xsd_types['type4'], xsd_types['type1'], xsd_types['type2'], xsd_types['type3']]
+        )
+        result.clear()
+        self.assertEqual(len(codegen.sort_types(xsd_types)), 4)
+        self.assertEqual(len(codegen._sorted_types), 1)
+
+    def test_sort_types_circularity(self):
+        schema = XMLSchema("""
+            <xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+                xmlns:tns="http://codegen.test/0" targetNamespace="http://codegen.test/0">
+              <xs:complexType name="type1">
+                <xs:sequence>
+                  <xs:element name="elem2" type="tns:type2" minOccurs="0"/>
+                </xs:sequence>
+              </xs:complexType>
+              <xs:complexType name="type2">
+                <xs:sequence>
+                  <xs:element name="elem1" type="tns:type1" minOccurs="0"/>
+                </xs:sequence>
+              </xs:complexType>
+              <xs:complexType name="type3">
+                <xs:sequence>
+                  <xs:element name="elem0" type="xs:string"/>
+                </xs:sequence>
+              </xs:complexType>
+            </xs:schema>""")
+        codegen = FortranGenerator(schema)
+        with self.assertRaises(ValueError) as ctx:
+            codegen.sort_types(schema.types)
+        self.assertIn('type1 -> type2 -> type1', str(ctx.exception))
+
+        xsd_types = schema.types
+        self.assertListEqual(codegen.sort_types(xsd_types, accept_circularity=True),
+                             [xsd_types['type3'], xsd_types['type1'], xsd_types['type2']])
+
 
 class TestPythonGenerator(TestAbstractGenerator):
 
@@ -223,3 +378,172 @@ class TestPythonGenerator(TestAbstractGenerator):
         self.assertListEqual(
             self.generator.render('python_type_filter_test.jinja'), ['str']
         )
+
+
+class TestGeneratorRegistry(unittest.TestCase):
+
+    def test_get_generator_class(self):
+        self.assertIs(get_generator_class('C'), CGenerator)
+        self.assertIs(get_generator_class('QE'), QEFortranGenerator)
+        with self.assertRaises(ValueError) as ctx:
+            get_generator_class('unknown')
+        self.assertIn("'QE-Python'", str(ctx.exception))
+
+    def test_register_generator(self):
+        try:
+            register_generator('Demo', 'tests.test_generators:DemoGenerator')
+            self.assertIs(get_generator_class('Demo'), DemoGenerator)
+            self.assertIs(GENERATORS['Demo'], DemoGenerator)
+        finally:
+            GENERATORS.pop('Demo', None)
+
+    def test_lazy_imports(self):
+        # The import time is measured by the benchmarks
+        timings, modules = measure_import_time('xsdtools.__main__', repeat=1)
+        self.assertNotIn('jinja2', modules)
+        self.assertNotIn('xmlschema', modules)
+
+    def test_command_line_third_party_generator(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            schema_file = Path(tmp_dir).joinpath('schema.xsd')
+            schema_file.write_text(XSD_TEST)
+            template_file = Path(tmp_dir).joinpath('demo.txt.jinja')
+            template_file.write_text('{{ schema.target_namespace }}')
+            output_dir = Path(tmp_dir).joinpath('output')
+
+            # Runs the CLI with the generator of this module registered
+            code = ("import sys, runpy; sys.path.insert(0, {!r}); "
+                    "from xsdtools import register_generator; "
+                    "register_generator('Demo', 'tests.test_generators:DemoGenerator'); "
+                    "runpy.run_module('xsdtools', run_name='__main__')").format(
+                str(Path(__file__).absolute().parent.parent))
+            args = [sys.executable, '-c', code, '--schema', str(schema_file),
+                    '--generator', 'Demo', '-o', str(output_dir), str(template_file)]
+
+            result = subprocess.run(args,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    universal_newlines=True)
+            self.assertEqual(result.returncode, 0, msg=result.stderr)
+            self.assertEqual(output_dir.joinpath('demo.txt').read_text(),
+                             'http://codegen.test/0')
+
+            # Options of xsdtools generators are rejected
+            result = subprocess.run(args + ['-j', '2'],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    universal_newlines=True)
+            self.assertEqual(result.returncode, 2)
+            self.assertIn('is not derived from xsdtools.AbstractGenerator', result.stderr)
+
+
+class TestWatch(unittest.TestCase):
+
+    def test_file_watcher(self):
+        with tempfile.TemporaryDirectory() as watch_dir:
+            path = Path(watch_dir).joinpath('schema.xsd')
+            path.write_text(XSD_READER_TEST)
+            Path(watch_dir).joinpath('output').mkdir()
+
+            watcher = FileWatcher([watch_dir], interval=0.01,
+                                  exclude=[str(Path(watch_dir).joinpath('output'))])
+            self.assertEqual(watcher.changes(), set())
+
+            Path(watch_dir).joinpath('.manifest').write_text('{}')
+            Path(watch_dir).joinpath('output/path.h').write_text('')
+            self.assertEqual(watcher.wait(timeout=0.05), set())
+
+            path.write_text(XSD_READER_TEST + '\n')
+            self.assertEqual(watcher.wait(), {str(path)})
+
+    def test_watch(self):
+        with tempfile.TemporaryDirectory() as watch_dir:
+            schema_path = Path(watch_dir).joinpath('schema.xsd')
+            schema_path.write_text(XSD_READER_TEST)
+            output_dir = Path(watch_dir).joinpath('output')
+            output_dir.mkdir()
+            schemas = []
+            rendered = []
+
+            def load_schema():
+                schemas.append(XMLSchema(str(schema_path)))
+                return schemas[-1]
+
+            def change_schema():
+                schema_path.write_text(XSD_READER_TEST.replace('"tag"', '"label"'))
+
+            # The schema is changed after the first rendering, when it's watched
+            timer = threading.Timer(0.2, change_schema)
+
+            def render(generators):
+                rendered.append(generators[0].render_to_files(
+                    'xsd_types.h.jinja', output_dir=str(output_dir), incremental=True
+                ))
+                if len(rendered) == 1:
+                    timer.start()
+
+            try:
+                watch(load_schema, lambda x: [CGenerator(x)], render,
+                      interval=0.05, exclude=[str(output_dir)], cycles=1)
+            finally:
+                timer.cancel()
+
+            self.assertEqual(len(schemas), 2)
+            self.assertEqual(len(rendered), 2)
+            self.assertEqual(rendered[0], rendered[1])
+            self.assertIn('char **label;', output_dir.joinpath('xsd_types.h').read_text())
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_load_batch(self):
+        with tempfile.TemporaryDirectory() as batch_dir:
+            manifest_file = Path(batch_dir).joinpath('batch.json')
+            manifest_file.write_text(json.dumps({'jobs': [
+                {'schema': 'schema.xsd', 'generator': 'C',
+                 'templates': 'xsd_types.h.jinja', 'output': 'c'}
+            ]}))
+            jobs = load_batch(str(manifest_file))
+            self.assertEqual(len(jobs), 1)
+            self.assertEqual(jobs[0].name, 'schema.xsd:C')
+            self.assertEqual(jobs[0].schema, str(Path(batch_dir).joinpath('schema.xsd')))
+            self.assertEqual(jobs[0].output, str(Path(batch_dir).joinpath('c')))
+            self.assertListEqual(jobs[0].templates, ['xsd_types.h.jinja'])
+
+            manifest_file.write_text(json.dumps({'jobs': [
+                {'schema': 'schema.xsd', 'generator': 'C', 'templates': [], 'jobs': 2}
+            ]}))
+            with self.assertRaises(ValueError) as ctx:
+                load_batch(str(manifest_file))
+            self.assertIn("unknown keys ['jobs']", str(ctx.exception))
+
+    def test_run_batch(self):
+        with tempfile.TemporaryDirectory() as batch_dir:
+            schema_file = Path(batch_dir).joinpath('schema.xsd')
+            schema_file.write_text(XSD_READER_TEST)
+            template_file = Path(batch_dir).joinpath('ns.txt.jinja')
+            template_file.write_text('{{ schema.target_namespace }}')
+
+            jobs = [
+                BatchJob(str(schema_file), 'C', 'xsd_*.jinja',
+                         output=str(Path(batch_dir).joinpath('c'))),
+                BatchJob(str(schema_file), 'Python', str(template_file),
+                         output=str(Path(batch_dir).joinpath('python'))),
+                BatchJob(str(schema_file), 'unknown', 'x.jinja', output=batch_dir),
+            ]
+            with self.assertLogs('xsdtools', 'ERROR'):
+                results = run_batch(jobs, max_workers=2)
+
+            self.assertListEqual([len(x.files) for x in results], [2, 1, 0])
+            self.assertIsNone(results[0].error)
+            self.assertIsNone(results[1].error)
+            self.assertIn("unknown generator 'unknown'", results[2].error)
+            self.assertEqual(results[1].load_time, 0.0)  # the schema is loaded once
+
+            schema = XMLSchema(str(schema_file))
+            self.assertEqual(Path(batch_dir).joinpath('c/xsd_types.h').read_text(),
+                             CGenerator(schema).render('xsd_types.h.jinja')[0])
+            self.assertEqual(Path(batch_dir).joinpath('python/ns.txt').read_text(),
+                             schema.target_namespace)
+
+            summary = format_summary(results).split('\n')
+            self.assertEqual(len(summary), 5)
+            self.assertRegex(summary[-1], r'^total\s+3\s.*\s1 failed$')
@@ -6,12 +6,28 @@
 # or https://opensource.org/licenses/BSD-3-Clause
 #
 import unittest
+import re
+import tempfile
+import types
+import io
+import sys
+import json
+import subprocess
 from pathlib import Path
+from xml.etree import ElementTree
 import jinja2
 import xmlschema
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # noinspection PyUnresolvedReferences
-from xsdtools import QEFortranGenerator
+from xsdtools import QEFortranGenerator, QEPythonGenerator
+from xsdtools.extract import SchemaExtractor, extract
+
+from .benchmark_generators import build_synthetic_schema
 
 
 class TestQEFortranGenerator(unittest.TestCase):
@@ -119,3 +135,686 @@ class TestQEFortranGenerator(unittest.TestCase):
         result = qe_generator.render('init/qes_init_module.f90.jinja')[0]
         self.assertIsInstance(result, str)
         self.check_module('samples/qe/qes_init_module.f90', result)
+
+    def test_render_to_files_parallel(self):
+        qe_generator = QEFortranGenerator(self.schema)
+        names = '*/qes_*_module.f90.jinja'
+
+        with tempfile.TemporaryDirectory() as serial_dir, \
+                tempfile.TemporaryDirectory() as parallel_dir:
+            serial_files = qe_generator.render_to_files(names, output_dir=serial_dir)
+            parallel_files = qe_generator.render_to_files(
+                names, output_dir=parallel_dir, jobs=3
+            )
+            self.assertEqual(len(serial_files), 8)
+            self.assertListEqual([Path(x).name for x in serial_files],
+                                 [Path(x).name for x in parallel_files])
+
+            for serial_file, parallel_file in zip(serial_files, parallel_files):
+                with open(serial_file) as fp1, open(parallel_file) as fp2:
+                    self.assertEqual(fp1.read(), fp2.read())
+
+    def test_render_to_files_incremental(self):
+        qe_generator = QEFortranGenerator(self.schema)
+        names = ['types/qes_types_module.f90.jinja', 'read/qes_read_module.f90.jinja']
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            rendered = qe_generator.render_to_files(names, output_dir=output_dir,
+                                                    incremental=True)
+            self.assertEqual(len(rendered), 2)
+            self.assertTrue(Path(output_dir).joinpath('.xsdtools-manifest.json').is_file())
+            mtimes = [Path(x).stat().st_mtime_ns for x in rendered]
+
+            self.assertListEqual(qe_generator.render_to_files(
+                names, output_dir=output_dir, incremental=True), [])
+
+            # A modified output file is rendered again
+            with open(rendered[0], 'a') as fp:
+                fp.write('! changed\n')
+            self.assertListEqual(qe_generator.render_to_files(
+                names, output_dir=output_dir, incremental=True), rendered[:1])
+
+            # A change of the types map invalidates all the outputs but
+            # the files with unchanged content are not rewritten
+            qe_generator.types_map = qe_generator.types_map.copy()
+            qe_generator.types_map['{http://www.w3.org/2001/XMLSchema}anyType'] = 'X'
+            self.assertListEqual(qe_generator.render_to_files(
+                names, output_dir=output_dir, incremental=True), rendered)
+            self.assertEqual(Path(rendered[1]).stat().st_mtime_ns, mtimes[1])
+
+    def test_render_to_files_incremental_untracked(self):
+        qe_generator = QEFortranGenerator(self.schema)
+        name = 'reset/qes_reset_module.f90.jinja'
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            output_file = Path(output_dir).joinpath('qes_reset_module.f90')
+            output_file.write_text('! hand-written\n')
+
+            # An existing file not tracked by the manifest is kept without force
+            with self.assertLogs('xsdtools', 'WARNING'):
+                self.assertListEqual(qe_generator.render_to_files(
+                    name, output_dir=output_dir, incremental=True), [])
+            self.assertEqual(output_file.read_text(), '! hand-written\n')
+
+            self.assertListEqual(qe_generator.render_to_files(
+                name, output_dir=output_dir, incremental=True, force=True), [str(output_file)])
+            self.assertListEqual(qe_generator.render_to_files(
+                name, output_dir=output_dir, incremental=True), [])
+
+    def test_type_fingerprint(self):
+        source = self.xsd_file.read_text()
+        schema = xmlschema.XMLSchema(source.replace(
+            '<element type="double" name="scf_error"/>',
+            '<element type="double" name="scf_error"/>\n'
+            '      <element type="double" name="scf_extra" minOccurs="0"/>'
+        ), base_url=str(self.xsd_file.parent))
+
+        generator1 = QEFortranGenerator(self.schema)
+        generator2 = QEFortranGenerator(schema)
+        for name, changed in [('scf_convType', True), ('convergence_infoType', True),
+                              ('espressoType', True), ('atomType', False),
+                              ('matrixType', False)]:
+            fingerprint1 = generator1.get_type_fingerprint(self.schema.types[name])
+            fingerprint2 = generator2.get_type_fingerprint(schema.types[name])
+            self.assertEqual(fingerprint1 != fingerprint2, changed, msg=name)
+
+    def test_render_to_files_fragments(self):
+        names = ['read/qes_read_module.f90.jinja', 'bcast/qes_bcast_module.f90.jinja']
+        source = self.xsd_file.read_text()
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            qe_generator = QEFortranGenerator(self.schema)
+            qe_generator.render_to_files(names, output_dir=output_dir, incremental=True)
+            self.assertTrue(Path(output_dir).joinpath('.xsdtools-fragments.json').is_file())
+
+            schema = xmlschema.XMLSchema(source.replace(
+                '<element type="double" name="scf_error"/>',
+                '<element type="double" name="scf_error"/>\n'
+                '      <element type="double" name="scf_extra" minOccurs="0"/>'
+            ), base_url=str(self.xsd_file.parent))
+            qe_generator = QEFortranGenerator(schema)
+            with self.assertLogs('xsdtools', 'INFO') as ctx:
+                rendered = qe_generator.render_to_files(names, output_dir=output_dir,
+                                                        incremental=True)
+
+            # Only the fragments of the changed type and of its dependants are rendered
+            self.assertIn('INFO:xsdtools:fragments: {} cached, 10 rendered'.format(
+                2 * len(schema.complex_types) - 10), ctx.output)
+            for name, path in zip(names, rendered):
+                self.assertIn('scf_extra', Path(path).read_text())
+                self.assertEqual(Path(path).read_text(), qe_generator.render(name)[0])
+
+            # Global variables are available to fragments and are part of their
+            # keys, fragments rendered by workers are counted too.
+            global_vars = {'author': 'QE'}
+            with self.assertLogs('xsdtools', 'INFO') as ctx:
+                qe_generator.render_to_files(names, global_vars=global_vars, jobs=2,
+                                             output_dir=output_dir, incremental=True)
+            self.assertIn('INFO:xsdtools:fragments: 0 cached, {} rendered'.format(
+                2 * len(schema.complex_types)), ctx.output)
+
+    def test_fragment_context(self):
+        with tempfile.TemporaryDirectory() as searchpath, \
+                tempfile.TemporaryDirectory() as output_dir:
+            Path(searchpath).joinpath('module.txt.jinja').write_text(
+                '{% set suffix = "_x" %}'
+                '{{ fragment("item.txt.jinja", schema.types["stepType"]) }}'
+            )
+            Path(searchpath).joinpath('item.txt.jinja').write_text(
+                '{{ author }}: {{ type.local_name }}{{ suffix }}'
+            )
+            qe_generator = QEFortranGenerator(self.schema, searchpath)
+            output_file = Path(output_dir).joinpath('module.txt')
+
+            for author in ('A', 'B'):
+                rendered = qe_generator.render_to_files(
+                    'module.txt.jinja', global_vars={'author': author},
+                    output_dir=output_dir, incremental=True
+                )
+                self.assertListEqual(rendered, [str(output_file)])
+                self.assertEqual(output_file.read_text(), '{}: stepType_x'.format(author))
+
+    def test_bytecode_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            qe_generator = QEFortranGenerator(self.schema, bytecode_cache=cache_dir)
+            result = qe_generator.render('reset/qes_reset_module.f90.jinja')[0]
+            self.assertTrue(any(Path(cache_dir).iterdir()))
+            self.check_module('samples/qe/qes_reset_module.f90', result)
+
+            qe_generator = QEFortranGenerator(self.schema, bytecode_cache=cache_dir)
+            self.assertEqual(qe_generator.render('reset/qes_reset_module.f90.jinja')[0], result)
+
+    def test_precompiled_templates(self):
+        with tempfile.TemporaryDirectory() as compiled_dir:
+            generator_class = type('PrecompiledGenerator', (QEFortranGenerator,), {
+                '__module__': __name__, 'compiled_templates': compiled_dir
+            })
+            self.assertIsNone(generator_class.get_precompiled_loader())
+            generator_class.compile_templates()
+            self.assertIsNotNone(generator_class.get_precompiled_loader())
+
+            qe_generator = generator_class(self.schema, precompiled=True)
+            self.assertIn('read/qes_read_module.f90.jinja', qe_generator.list_templates())
+            result = qe_generator.render('bcast/qes_bcast_module.f90.jinja')[0]
+            self.check_module('samples/qe/qes_bcast_module.f90', result)
+
+            # Template hashes of incremental rendering are computed from the sources
+            names = ['reset/qes_reset_module.f90.jinja', 'read/qes_read_module.f90.jinja']
+            self.assertEqual(qe_generator.get_template_hash(names[1]),
+                             QEFortranGenerator(self.schema).get_template_hash(names[1]))
+            with tempfile.TemporaryDirectory() as output_dir:
+                rendered = qe_generator.render_to_files(names, output_dir=output_dir,
+                                                        incremental=True)
+                self.assertEqual(len(rendered), 2)
+                self.assertListEqual(qe_generator.render_to_files(
+                    names, output_dir=output_dir, incremental=True), [])
+
+            # Outdated bundles are ignored
+            with Path(compiled_dir).joinpath('bundle.json').open('w') as fp:
+                fp.write('{"jinja2": "%s", "templates": "0"}' % jinja2.__version__)
+            with self.assertLogs('xsdtools', level='WARNING'):
+                self.assertIsNone(generator_class.get_precompiled_loader())
+
+    def test_types_index(self):
+        qe_generator = QEFortranGenerator(self.schema)
+        matrix_type = self.schema.types['matrixType']
+        vector_type = self.schema.types['vectorType']
+
+        type_info = qe_generator.get_type_info(matrix_type)
+        self.assertTrue(type_info.is_matrix)
+        self.assertFalse(type_info.is_vector)
+        self.assertTrue(qe_generator.filters['is_vector_type'](vector_type))
+        self.assertTrue(qe_generator.filters['is_qes_array_type'](vector_type))
+        self.assertNotIn('rank', [x.local_name for x in
+                                  qe_generator.filters['attributes_list'](matrix_type)])
+        self.assertEqual(qe_generator.filters['fortran_type'](vector_type),
+                         'REAL(DP), DIMENSION(:), ALLOCATABLE')
+        self.assertEqual(qe_generator.filters['init_fortran_type'](vector_type),
+                         'REAL(DP), DIMENSION(:)')
+        self.assertIs(qe_generator.get_type_info(matrix_type), type_info)
+
+        # Replacing the types map invalidates the index
+        types_map = qe_generator.types_map.copy()
+        types_map['{%s}vectorType' % self.schema.target_namespace] = 'REAL(SP), POINTER'
+        qe_generator.types_map = types_map
+        self.assertIsNot(qe_generator.get_type_info(matrix_type), type_info)
+        self.assertEqual(qe_generator.filters['init_fortran_type'](vector_type),
+                         'REAL(SP), POINTER')
+
+    def test_custom_types_map(self):
+        qe_generator = QEFortranGenerator(self.schema, types_map={'vectorType': 'VECTOR'})
+        self.assertEqual(qe_generator.map_type(self.schema.types['vectorType']), 'VECTOR')
+        self.assertEqual(qe_generator.map_type(self.schema.types['d3vectorType']),
+                         'REAL(DP), DIMENSION(3)')
+
+    def test_generate(self):
+        qe_generator = QEFortranGenerator(self.schema)
+        name = 'init/qes_init_module.f90.jinja'
+        chunks = qe_generator.generate(name)
+        self.assertNotIsInstance(chunks, (str, list))
+        self.assertEqual(''.join(chunks), qe_generator.render(name)[0])
+
+    def test_render_to_files_streaming(self):
+        qe_generator = QEFortranGenerator(self.schema)
+        name = 'write/qes_write_module.f90.jinja'
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            rendered = qe_generator.render_to_files(name, output_dir=output_dir)
+            self.assertListEqual([Path(x).name for x in rendered], ['qes_write_module.f90'])
+            self.assertListEqual([x.name for x in Path(output_dir).iterdir()],
+                                 ['qes_write_module.f90'])
+            with open(rendered[0]) as fp:
+                self.assertEqual(fp.read(), qe_generator.render(name)[0])
+
+    def test_synthetic_schema(self):
+        schema = xmlschema.XMLSchema11(build_synthetic_schema(100, depth=3))
+        self.assertGreaterEqual(len(schema.complex_types), 100)
+
+        qe_generator = QEFortranGenerator(schema)
+        self.assertTrue(qe_generator.is_matrix_type(schema.types['array0_2Type']))
+        self.assertTrue(qe_generator.is_vector_type(schema.types['array1_2Type']))
+        result = qe_generator.render('types/qes_types_module.f90.jinja')[0]
+        self.assertIn('TYPE :: array0_2_type', result)
+
+    def test_profiling(self):
+        qe_generator = QEFortranGenerator(self.schema)
+        profiler = qe_generator.enable_profiling()
+        self.assertIs(qe_generator.profiler, profiler)
+
+        result = qe_generator.render('reset/qes_reset_module.f90.jinja')[0]
+        self.check_module('samples/qe/qes_reset_module.f90', result)
+
+        entries = profiler.entries
+        self.assertEqual(entries['template', 'reset/qes_reset_module.f90.jinja'].calls, 1)
+        self.assertEqual(entries['template', 'reset/reset_subroutines.f90.jinja'].calls,
+                         len(self.schema.complex_types))
+        self.assertGreater(entries['filter', 'type_name'].calls, 0)
+        self.assertGreater(entries['test', 'extension'].calls, 0)
+
+        module_entry = entries['template', 'reset/qes_reset_module.f90.jinja']
+        self.assertLessEqual(module_entry.self_time, module_entry.total_time)
+        self.assertEqual(profiler.get_stats()[0], module_entry)
+        self.assertIn('reset/reset_subroutines.f90.jinja', profiler.as_table())
+        self.assertIn('"kind": "filter"', profiler.as_json())
+
+    def test_render_binio_module(self):
+        qe_generator = QEFortranGenerator(self.schema)
+        num_types = len(self.schema.complex_types)
+        result = qe_generator.render('binio/qes_binio_module.f90.jinja')[0]
+
+        self.assertIn('MODULE qes_binio_module', result)
+        self.assertIn('CHARACTER(LEN=*), PARAMETER :: qes_binio_version = "{}"'
+                      .format(self.schema.version), result)
+        for action in ('write', 'read', 'put', 'get'):
+            self.assertEqual(result.count('END SUBROUTINE qes_binio_{}_'.format(action)),
+                             num_types + (0 if action in ('write', 'read') else 7))
+
+        matrix_type = self.schema.types['matrixType']
+        layout_hash = qe_generator.layout_hash(matrix_type)
+        self.assertEqual(len(layout_hash), 16)
+        self.assertIn("ELSE IF (layout_hash /= '{}') THEN".format(layout_hash), result)
+        self.assertIn('    ALLOCATE(obj%matrix(n))\n'
+                      '    CALL qes_binio_get_item(unit, obj%matrix)', result)
+
+        # The layout hash changes with the Fortran types of the components
+        qe_generator = QEFortranGenerator(
+            self.schema, types_map={'doubleListType': 'INTEGER, DIMENSION(:), ALLOCATABLE'}
+        )
+        self.assertNotEqual(qe_generator.layout_hash(matrix_type), layout_hash)
+
+        # Replacing the types map invalidates the layout hashes
+        qe_generator = QEFortranGenerator(self.schema)
+        self.assertEqual(qe_generator.layout_hash(matrix_type), layout_hash)
+        types_map = qe_generator.types_map.copy()
+        types_map[matrix_type.content.name] = 'INTEGER, DIMENSION(:), ALLOCATABLE'
+        qe_generator.types_map = types_map
+        self.assertNotEqual(qe_generator.layout_hash(matrix_type), layout_hash)
+
+    def test_read_mode_children(self):
+        qe_generator = QEFortranGenerator(self.schema, options={'read_mode': 'children'})
+        self.assertEqual(qe_generator.options['read_mode'], 'children')
+
+        result = qe_generator.render('read/qes_read_module.f90.jinja')[0]
+        self.assertNotIn('getElementsByTagname', result)
+        self.assertEqual(result.count('END SUBROUTINE qes_read_'),
+                         len(self.schema.complex_types))
+        self.assertIn('tmp_node_list => getChildNodes(xml_node)', result)
+        self.assertIn('CASE ("ks_energies")', result)
+        self.assertIn('obj%ks_energies(iocc_ks_energies)', result)
+        self.assertIn('obj%smearing_ispresent = nocc_smearing > 0', result)
+
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'read_mode': 'unknown'})
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'write_mode': 'children'})
+
+    def test_bcast_mode_packed(self):
+        qe_generator = QEFortranGenerator(self.schema, options={'bcast_mode': 'packed'})
+        result = qe_generator.render('bcast/qes_bcast_module.f90.jinja')[0]
+
+        num_types = len(self.schema.complex_types)
+        self.assertEqual(result.count('MODULE PROCEDURE qes_bcast_'), num_types)
+        for action in ('bcast', 'size', 'pack', 'unpack'):
+            self.assertEqual(result.count('END SUBROUTINE qes_{}_'.format(action)),
+                             num_types + (1 if action == 'bcast' else 7))
+
+        self.assertEqual(result.count('CALL mp_bcast('), num_types + 1)
+        self.assertIn('INTEGER, PARAMETER :: qes_bcast_chunk_size = 67108864', result)
+        self.assertIn('    ALLOCATE(obj%matrix(n))\n', result)
+        self.assertIn('INTEGER(KIND=8), INTENT(INOUT) :: pos', result)
+        self.assertEqual(result.count('object too large for a packed broadcast'), num_types)
+
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'bcast_mode': 'unknown'})
+
+    def test_write_mode_bulk(self):
+        qe_generator = QEFortranGenerator(self.schema, options={
+            'write_mode': 'bulk', 'write_line_values': 4, 'write_real_format': 'ES20.12'
+        })
+        result = qe_generator.render('write/qes_write_module.f90.jinja')[0]
+        self.assertEqual(result.count('END SUBROUTINE qes_write_'),
+                         len(self.schema.complex_types))
+        self.assertIn('FUNCTION qes_format_reals(values, line_values)', result)
+        self.assertIn("'(1X,ES20.12))'", result)
+        self.assertIn('qes_format_reals(obj%vector, 4)', result)
+        self.assertIn('qes_format_reals(obj%matrix, obj%dims(1))', result)
+        self.assertNotIn("obj%vector(i:MIN(i+5-1,obj%size)), fmt='s16'", result)
+        self.assertIn('INTEGER, PARAMETER, PRIVATE :: qes_field_width = 21\n', result)
+
+        qe_generator = QEFortranGenerator(self.schema, options={
+            'write_mode': 'bulk', 'write_real_format': '1P,E64.40E3', 'write_integer_format': 'B0'
+        })
+        result = qe_generator.render('write/qes_write_module.f90.jinja')[0]
+        self.assertIn('INTEGER, PARAMETER, PRIVATE :: qes_field_width = 65\n', result)
+        self.assertEqual(qe_generator.format_width('B0', integer=True), 32)
+        self.assertIsNone(qe_generator.format_width('G0'))
+
+        result = QEFortranGenerator(self.schema).render('write/qes_write_module.f90.jinja')[0]
+        self.assertNotIn('qes_format_reals', result)
+
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'write_real_format': 'F0.6'})
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'write_integer_format': '(I8)'})
+
+    def test_code_mode_compact(self):
+        qe_generator = QEFortranGenerator(self.schema, options={'code_mode': 'compact'})
+        num_types = len(self.schema.complex_types)
+
+        fields = qe_generator.compact_fields(self.schema.types['matrixType'])
+        self.assertListEqual([(x.name, x.role, x.kind, x.size, x.extent) for x in fields], [
+            ('rank', 'attribute', 'integer', 0, 0),
+            ('dims', 'attribute', 'integer', -1, 1),
+            ('order', 'attribute', 'character', 0, 0),
+            ('matrix', 'content', 'real', -1, 2),
+        ])
+        fields = qe_generator.compact_fields(self.schema.types['atomic_positionsType'])
+        self.assertEqual(len(fields), 1)
+        self.assertEqual(fields[0].kind, 'derived')
+        self.assertIs(fields[0].xsd_type, self.schema.types['atomType'])
+        self.assertTrue(fields[0].is_multiple)
+        self.assertEqual(qe_generator.type_id(self.schema.complex_types[0]), 1)
+
+        result = qe_generator.render('types/qes_types_module.f90.jinja')[0]
+        self.assertEqual(result.count('END SUBROUTINE qes_bind'), num_types + 1)
+        self.assertIn('INTEGER, PARAMETER :: qes_type_first({})'.format(num_types + 1), result)
+        self.assertIn("qes_field('atom', qes_element, qes_derived, -1, 1, qes_unbounded, "
+                      "qes_atom_id, 0)", result)
+
+        for name, helpers in (('read', 4), ('bcast', 2), ('reset', 1)):
+            result = qe_generator.render('{0}/qes_{0}_module.f90.jinja'.format(name))[0]
+            self.assertEqual(result.count('MODULE PROCEDURE qes_{}_'.format(name)), num_types)
+            self.assertEqual(result.count('END SUBROUTINE qes_{}_'.format(name)),
+                             num_types + helpers)
+            self.assertIn('RECURSIVE SUBROUTINE qes_{}_object('.format(name), result)
+
+        result = QEFortranGenerator(self.schema).render('types/qes_types_module.f90.jinja')[0]
+        self.assertNotIn('qes_bind', result)
+
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'code_mode': 'compact',
+                                                     'bcast_mode': 'packed'})
+
+    def test_module_layout_submodules(self):
+        qe_generator = QEFortranGenerator(self.schema, options={
+            'module_layout': 'submodules', 'submodule_size': 40
+        })
+        num_types = len(self.schema.complex_types)
+        num_submodules = (num_types + 39) // 40
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_dir = Path(tmpdir)
+            files = qe_generator.render_to_files(
+                ['read/qes_read_module.f90.jinja', 'init/qes_init_module.f90.jinja'],
+                output_dir=tmpdir
+            )
+            self.assertEqual(len(files), 3 + 2 * num_submodules)
+            self.assertEqual(files[-1], str(output_dir.joinpath('qes_modules.d')))
+
+            result = output_dir.joinpath('qes_read_module.f90').read_text()
+            self.assertEqual(result.count('MODULE SUBROUTINE qes_read_'), num_types)
+            self.assertNotIn('obj%lwrite = .TRUE.', result)
+
+            submodule_file = output_dir.joinpath('qes_read_submodule_1.f90')
+            result = submodule_file.read_text()
+            self.assertIn('SUBMODULE (qes_read_module) qes_read_submodule_1', result)
+            self.assertEqual(result.count('MODULE SUBROUTINE qes_read_'), 40)
+
+            # Matrix init variants are grouped with their type
+            result = output_dir.joinpath('qes_init_module.f90').read_text()
+            self.assertIn('CHARACTER(LEN=*),OPTIONAL :: order', result)
+
+            dependencies = output_dir.joinpath('qes_modules.d').read_text().splitlines()
+            self.assertIn('qes_read_submodule_1.o : qes_read_module.o', dependencies)
+            self.assertEqual(len(dependencies), 2 * num_submodules)
+
+            # Unchanged submodules are kept, stale submodules are removed
+            mtime = submodule_file.stat().st_mtime_ns
+            QEFortranGenerator(self.schema, options={
+                'module_layout': 'submodules', 'submodule_size': 40
+            }).render_to_files('read/qes_read_module.f90.jinja', output_dir=tmpdir, force=True)
+            self.assertEqual(submodule_file.stat().st_mtime_ns, mtime)
+
+            QEFortranGenerator(self.schema, options={
+                'module_layout': 'submodules', 'submodule_size': num_types
+            }).render_to_files('read/qes_read_module.f90.jinja', output_dir=tmpdir, force=True)
+            self.assertListEqual([x.name for x in output_dir.glob('qes_read_submodule_*')],
+                                 ['qes_read_submodule_1.f90'])
+
+        result = QEFortranGenerator(self.schema).render('read/qes_read_module.f90.jinja')[0]
+        self.assertNotIn('MODULE SUBROUTINE', result)
+
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'submodule_size': 0})
+
+    def test_init_mode_move(self):
+        qe_generator = QEFortranGenerator(self.schema, options={'init_mode': 'move'})
+        result = qe_generator.render('init/qes_init_module.f90.jinja')[0]
+        self.assertIn('    MODULE PROCEDURE qes_init_matrix_move\n', result)
+        self.assertIn('    MODULE PROCEDURE qes_init_integerVector_move\n', result)
+        self.assertIn('SUBROUTINE qes_init_matrix_move(obj, array, tagname, dims, order)', result)
+        self.assertIn('REAL(DP), DIMENSION(:), ALLOCATABLE, INTENT(INOUT) :: array', result)
+        self.assertIn('CALL MOVE_ALLOC(array, obj%matrix)', result)
+        num_moves = len(re.findall(r'MODULE PROCEDURE qes_init_\w+_move\n', result))
+        self.assertGreater(num_moves, 4)
+        self.assertEqual(len(re.findall(r'END SUBROUTINE qes_init_\w+_move\n', result)), num_moves)
+        self.assertEqual(qe_generator._submodule_group('qes_init_matrix_move'), 'matrix')
+
+        result = QEFortranGenerator(self.schema).render('init/qes_init_module.f90.jinja')[0]
+        self.assertNotIn('MOVE_ALLOC', result)
+
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'init_mode': 'unknown'})
+
+    def test_types_layout_compact(self):
+        qe_generator = QEFortranGenerator(self.schema, options={'types_layout': 'compact'})
+        result = qe_generator.render('types/qes_types_module.f90.jinja')[0]
+        self.assertNotIn('CHARACTER(len=100) :: tagname', result)
+        self.assertIn('    INTEGER :: tagid = 0\n', result)
+        self.assertIn('    CHARACTER(len=:), ALLOCATABLE :: name\n', result)
+        self.assertIn('    INTEGER :: calculation\n', result)
+        self.assertIn('  INTEGER, PARAMETER :: qes_calculation_scf = 1\n', result)
+        self.assertIn('  PURE FUNCTION qes_tagid(tagname) RESULT(tagid)', result)
+
+        result = qe_generator.render('read/qes_read_module.f90.jinja')[0]
+        self.assertIn('CALL qes_read_enum(tmp_node, qes_calculation_names, '
+                      'obj%calculation, IOSTAT = iostat_)', result)
+        self.assertIn('      CALL qes_read_string(tmp_node, obj%non_local_term, IOSTAT = iostat_)\n'
+                      '      IF ( iostat_ /= 0 ) THEN\n', result)
+
+        qe_generator = QEFortranGenerator(
+            self.schema, options={'types_layout': 'compact', 'read_mode': 'children'}
+        )
+        result = qe_generator.render('read/qes_read_module.f90.jinja')[0]
+        self.assertIn('CALL qes_read_enum(tmp_node, qes_calculation_names, '
+                      'obj%calculation, IOSTAT = iostat_)\n'
+                      '        IF ( iostat_ /= 0 ) THEN\n', result)
+        result = qe_generator.render('write/qes_write_module.f90.jinja')[0]
+        self.assertIn('CALL xml_NewElement(xp, qes_tagname(obj%tagid))', result)
+        self.assertNotIn('TRIM(obj%tagname)', result)
+        result = qe_generator.render('init/qes_init_module.f90.jinja')[0]
+        self.assertIn('obj%tagid = qes_tagid(tagname)', result)
+
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'types_layout': 'compact',
+                                                     'code_mode': 'compact'})
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'types_layout': 'unknown'})
+
+    def test_read_select_paths(self):
+        qe_generator = QEFortranGenerator(self.schema, options={'read_select': 'paths'})
+        result = qe_generator.render('read/qes_read_module.f90.jinja')[0]
+        self.assertIn('  SUBROUTINE qes_read_band_structure(xml_node, obj, ierr, paths )\n', result)
+        self.assertIn('    CHARACTER(LEN=*), OPTIONAL, INTENT(IN)            :: paths(:)\n', result)
+        self.assertIn('    IF (qes_read_selected("ks_energies", paths)) THEN\n', result)
+        self.assertIn('      obj%ndim_ks_energies = 0\n', result)
+        self.assertIn('qes_read_subpaths("ks_energies", paths) )', result)
+        self.assertIn('  PURE FUNCTION qes_read_subpaths(name, paths) RESULT(subpaths)', result)
+
+        qe_generator = QEFortranGenerator(
+            self.schema, options={'read_select': 'paths', 'read_mode': 'children'}
+        )
+        result = qe_generator.render('read/qes_read_module.f90.jinja')[0]
+        self.assertIn('    read_ks_energies = qes_read_selected("ks_energies", paths)\n', result)
+        self.assertIn('    IF (read_ks_energies) ALLOCATE(obj%ks_energies(nocc_ks_energies))\n',
+                      result)
+
+        result = QEFortranGenerator(self.schema).render('read/qes_read_module.f90.jinja')[0]
+        self.assertNotIn('paths', result)
+
+        with self.assertRaises(ValueError):
+            QEFortranGenerator(self.schema, options={'read_select': 'paths',
+                                                     'code_mode': 'compact'})
+
+    def test_write_stream_append(self):
+        qe_generator = QEFortranGenerator(self.schema, options={'write_stream': 'append'})
+        espresso_type = self.schema.types['espressoType']
+        self.assertEqual(qe_generator.stream_element(espresso_type).local_name, 'step')
+        self.assertIsNone(qe_generator.stream_element(self.schema.types['dftUType']))
+
+        result = qe_generator.render('write/qes_write_module.f90.jinja')[0]
+        self.assertIn('    MODULE PROCEDURE qes_write_espresso_open\n', result)
+        self.assertIn('    MODULE PROCEDURE qes_write_band_structure_append\n', result)
+        self.assertNotIn('qes_write_dftU_open', result)
+        self.assertIn('   SUBROUTINE qes_write_espresso_append(xp, obj, item)\n', result)
+        self.assertIn('     CALL qes_write_step(xp, item)\n', result)
+
+        # The children before and after the appended items
+        start = result.index('   SUBROUTINE qes_write_espresso_open(')
+        stop = result.index('   END SUBROUTINE qes_write_espresso_open')
+        self.assertIn('CALL qes_write_input (xp, obj%input)', result[start:stop])
+        self.assertNotIn('qes_write_output', result[start:stop])
+        self.assertNotIn('xml_EndElement(xp, TRIM(obj%tagname))', result[start:stop])
+        start = result.index('   SUBROUTINE qes_write_espresso_close(')
+        stop = result.index('   END SUBROUTINE qes_write_espresso_close')
+        self.assertIn('CALL qes_write_output (xp, obj%output)', result[start:stop])
+        self.assertNotIn('qes_write_input', result[start:stop])
+        self.assertEqual(qe_generator._submodule_group('qes_write_espresso_close'), 'espresso')
+
+        result = QEFortranGenerator(self.schema).render('write/qes_write_module.f90.jinja')[0]
+        self.assertNotIn('qes_write_open', result)
+
+
+class TestQEPythonGenerator(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        xsd_file = Path(__file__).absolute().parent.joinpath('schemas/qe/qes-refactored.xsd')
+        cls.schema = xmlschema.XMLSchema(str(xsd_file))
+
+    def test_render_types_module(self):
+        qe_generator = QEPythonGenerator(self.schema)
+        result = qe_generator.render('qes_types.py.jinja')[0]
+        compile(result, 'qes_types.py', 'exec')
+
+        self.assertIn('class matrixType(QesObject):', result)
+        self.assertIn("    __slots__ = ('order', 'value')\n", result)
+        self.assertEqual(result.count('    def from_element(cls, elem):'),
+                         len(self.schema.complex_types) + 1)
+        self.assertIn("'{{{}}}espresso': espressoType,".format(self.schema.target_namespace),
+                      result)
+
+        with self.assertRaises(AssertionError):
+            QEPythonGenerator(xmlschema.XMLSchema(
+                '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"/>'
+            ))
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_element_binding(self):
+        qe_generator = QEPythonGenerator(self.schema)
+        module = types.ModuleType('qes_types')
+        exec(qe_generator.render('qes_types.py.jinja')[0], module.__dict__)
+
+        source = '<atomic_species ntyp="2">' \
+                 '<species name="Si"><mass>28.0855</mass><pseudo_file>Si.UPF</pseudo_file>' \
+                 '</species><species name="O"><pseudo_file>O.UPF</pseudo_file></species>' \
+                 '</atomic_species>'
+        obj = module.atomic_speciesType.from_element(ElementTree.fromstring(source))
+        self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertEqual(obj.ntyp, 2)
+        self.assertIsNone(obj.pseudo_dir)
+        self.assertEqual([x.name for x in obj.species], ['Si', 'O'])
+        self.assertEqual(obj.species[0].mass, 28.0855)
+        self.assertIsNone(obj.species[1].mass)
+        self.assertEqual(obj.to_string(), source)
+
+        source = '<Hubbard_ns specie="Ni" label="3d" spin="1" index="1" rank="2" ' \
+                 'dims="2 3" order="F">1 2 3 4 5 6</Hubbard_ns>'
+        obj = module.Hubbard_nsType.from_element(ElementTree.fromstring(source))
+        self.assertEqual(obj.value.shape, (2, 3))
+        self.assertEqual(obj.value[1, 0], 2.0)
+
+        elem = obj.to_element()
+        self.assertEqual(elem.get('dims'), '2 3')
+        self.assertEqual(elem.text, '1.0 2.0 3.0 4.0 5.0 6.0')
+        self.assertTrue(self.schema.types['Hubbard_nsType'].is_valid(elem))
+
+
+def qe_trajectory(num_steps, nat=2):
+    steps = []
+    for k in range(num_steps):
+        atoms = ''.join('<atom name="H" index="{}">{} 0.0 1.0</atom>'.format(i + 1, k + i)
+                        for i in range(nat))
+        forces = ' '.join(str(k + i) for i in range(3 * nat))
+        steps.append(
+            '<step n_step="{0}"><scf_conv><n_scf_steps>5</n_scf_steps>'
+            '<scf_error>1e-7</scf_error></scf_conv><atomic_structure nat="{1}">'
+            '<atomic_positions>{2}</atomic_positions></atomic_structure>'
+            '<total_energy><etot>-{0}.5</etot></total_energy>'
+            '<forces rank="2" dims="3 {1}" order="F">{3}</forces></step>'.format(
+                k + 1, nat, atoms, forces))
+    return '<qes:espresso xmlns:qes="http://www.quantum-espresso.org/ns/qes/qes-1.0">' \
+           '{}</qes:espresso>'.format(''.join(steps))
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class TestExtract(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.xsd_file = Path(__file__).absolute().parent.joinpath('schemas/qe/qes.xsd')
+        cls.schema = xmlschema.XMLSchema(str(cls.xsd_file))
+
+    def test_extract(self):
+        source = io.StringIO(qe_trajectory(3))
+        data = extract(self.schema, source, ['espresso/step/forces',
+                                             'espresso/step/total_energy/etot',
+                                             '/espresso/*/atomic_structure'])
+        self.assertListEqual(list(data), ['espresso/step/atomic_structure',
+                                          'espresso/step/total_energy/etot',
+                                          'espresso/step/forces'])
+        self.assertListEqual(data['espresso/step/total_energy/etot'], [-1.5, -2.5, -3.5])
+
+        forces = data['espresso/step/forces']
+        self.assertEqual(len(forces), 3)
+        self.assertEqual(forces[2].shape, (3, 2))
+        self.assertEqual(forces[2][1, 0], 3.0)  # Fortran order
+
+        structure = data['espresso/step/atomic_structure'][1]
+        self.assertEqual(structure['@nat'], 2)
+        atom = structure['atomic_positions']['atom'][1]
+        self.assertEqual(atom['@name'], 'H')
+        self.assertListEqual(atom['$'].tolist(), [2.0, 0.0, 1.0])
+
+        with self.assertRaises(ValueError):
+            SchemaExtractor(self.schema, ['espresso//forces'])
+
+    def test_command_line(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = Path(tmp_dir).joinpath('pwscf.xml')
+            source.write_text(qe_trajectory(4))
+            args = [sys.executable, '-m', 'xsdtools', 'extract', '--schema', str(self.xsd_file),
+                    str(source), 'espresso/step/total_energy/etot']
+            result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    universal_newlines=True)
+            self.assertEqual(result.returncode, 0, msg=result.stderr)
+            lines = [json.loads(x) for x in result.stdout.splitlines()]
+            self.assertListEqual([x['value'] for x in lines], [-1.5, -2.5, -3.5, -4.5])
+
+            npz_file = Path(tmp_dir).joinpath('forces.npz')
+            result = subprocess.run(args[:-1] + ['--npz', str(npz_file), 'espresso/step/forces'],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    universal_newlines=True)
+            self.assertEqual(result.returncode, 0, msg=result.stderr)
+            with np.load(str(npz_file)) as arrays:
+                self.assertEqual(arrays['espresso/step/forces'].shape, (4, 3, 2))